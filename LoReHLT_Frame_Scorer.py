@@ -11,26 +11,46 @@ __date__ = "09/04/2019"
 import os
 import sys
 import argparse
+import csv
+import multiprocessing
+import traceback
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 import re
 
-from sklearn.metrics import precision_score, recall_score, f1_score
 
 
 from lib.lorehlt19helper import (
-    boolean_gravity,
-    numeric_gravity,
-    getReference,
-    getsubmission,
+    boolean_gravity_column,
+    numeric_gravity_column,
+    getReferenceBase,
+    ANNOTATOR_CHOICES,
+    referenceWithGravity,
+    getsubmissionBase,
+    SUBMISSION_CHUNKSIZE,
+    thresholdsubmission,
+    withgravity,
     correctkbids,
+    frame_alignment,
     genMAPMAR_results,
+    genMAPMAR_systems,
+    writeMAPMAR_results,
+    stacksubmissions,
+    summary_scores,
+    threshold_sweep,
     genNDCG,
+    genNDCG_variants,
+    genNDCG_systems,
+    NDCG_BREAKTIES,
     genNDCGplot,
     genSEC_results,
+    NIL_MATCH_POLICIES,
+    edl_index,
     getreferenceNDCG,
     genNDCG_results,
     precisionN,
+    precisionN_systems,
     genprecisionN_results,
     genpr_dt,
     genpr_dtp,
@@ -38,10 +58,15 @@ from lib.lorehlt19helper import (
     genpr_dtpsu,
     genpr_dtpsr,
     genpr_dtpsur,
+    genpr,
     plotpr,
+    precision_recall_scores,
+    precision_recall_systems,
+    genF1_results,
+    genOptimalF1_results,
 )
 
-gravity_choices = {"numeric": numeric_gravity, "boolean": boolean_gravity}
+gravity_choices = {"numeric": numeric_gravity_column, "boolean": boolean_gravity_column}
 ndcgmethod_choices = {"method0": 0, "method1": 1}
 
 def define_parser():
@@ -49,12 +74,25 @@ def define_parser():
     parser = argparse.ArgumentParser(
         description="Generates PR curves for the LORELEI speech evaluation"
     )
-    parser.add_argument("-s", "--system-output", help="Path to the system output", required=True)
+    parser.add_argument("-s", "--system-output", help="Path to the system output (required without --manifest)", required=False)
     parser.add_argument(
         "-g", "--ground-truth", help="Path to the ground truth directory", required=True
     )
     parser.add_argument("-e", "--edl-subm", help="Path to the EDL submission file", required=False)
     parser.add_argument("-r", "--edl-ref", help="Path to the EDL reference file", required=False)
+    parser.add_argument(
+        "--edl-submission-docs",
+        help="If present will only read the EDL mentions of the documents in the system output when resolving NIL ids.",
+        required=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--nil-match",
+        choices=NIL_MATCH_POLICIES,
+        default="exact",
+        help="How the submission NIL mentions are matched to the EDL reference mentions. 'exact' requires identical extents, "
+        "'overlap' takes the reference mention of the same document that overlaps the submission mention most.",
+    )
 
     parser.add_argument(
         "--gravity",
@@ -76,7 +114,7 @@ def define_parser():
     parser.add_argument(
         "-o", "--output-directory", help="Path to save the evaluation output", required=True
     )
-    parser.add_argument("-m", "--system-name", help="Name of the SF system", required=True)
+    parser.add_argument("-m", "--system-name", help="Name of the SF system (required without --manifest)", required=False)
     parser.add_argument(
         "-p", "--filename-prefix", help="prefix for output files", required=False, default=""
     )
@@ -101,10 +139,77 @@ def define_parser():
         action="store_true",
     )
 
+    parser.add_argument(
+        "--annotator-choice",
+        choices=ANNOTATOR_CHOICES,
+        default="perfile",
+        help="How the annotator of each multiply annotated reference file is chosen. 'perfile' makes the choice from the file name, "
+        "'sequential' reproduces the choices of releases up to 0.9.7.",
+    )
+
     parser.add_argument(
         "-t", "--system-threshold", help="Threshold", required=False, default=0, type=float
     )
 
+    parser.add_argument(
+        "--precisionn-cutoffs",
+        help="If present will only report precision at the given N values (e.g. 5 10 20 50).",
+        required=False,
+        nargs="+",
+        type=int,
+    )
+
+    parser.add_argument(
+        "--threshold-sweep",
+        help="Thresholds (numbers or inclusive start:stop:step ranges, e.g. 0:1:0.1) at which to also compute nDCG, MAP/MAR and precision at N, "
+        "discarding the frames of confidence at or below each, in one pass. Writes a table with a row per threshold to threshold_sweep.txt.",
+        required=False,
+        nargs="+",
+    )
+
+    parser.add_argument(
+        "--stream-submission",
+        help="If present will read and validate the submission incrementally to bound memory use on very large submissions.",
+        required=False,
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--reference-cache",
+        help="Directory in which to cache the parsed ground truth and an index of the EDL reference, so later runs against the same reference skip parsing them.",
+        required=False,
+    )
+
+    parser.add_argument(
+        "--manifest",
+        help="Path to a tab separated manifest of systems to score against the ground truth instead of -s and -m, one per line: "
+        "system name, system output, and optionally EDL submission and filename prefix (defaulting to -e and -p). "
+        "The ground truth is loaded once and every system is scored into the subdirectory of the output directory named after it.",
+        required=False,
+    )
+
+    parser.add_argument(
+        "--workers",
+        help="Number of processes scoring the systems of a manifest. Defaults to the number of CPUs.",
+        required=False,
+        type=int,
+    )
+
+    parser.add_argument(
+        "--reference-workers",
+        help="Number of processes reading the ground truth files. Defaults to the number of CPUs; 1 reads them in the scorer process.",
+        required=False,
+        type=int,
+    )
+
+    parser.add_argument(
+        "--stacked",
+        help="With --manifest, computes the nDCG, MAP/MAR, precision at N and PR scores of all the systems at once from one stacked table "
+        "instead of in separate processes, and writes the scores of every system side by side to cross_system_scores.txt in the output directory.",
+        required=False,
+        action="store_true",
+    )
+
     parser.add_argument(
         "--computepr",
         help="If present will compute Precision, Recall, F1 and generate PR Curves for different equivalence classes.",
@@ -115,24 +220,29 @@ def define_parser():
     return parser
 
 
-def main():
-    debug = False
-
-    args = define_parser().parse_args()
-    print(args)
-    print("skipsec is: ", str(args.skip_sec))
-
+# the PR equivalence classes scored with --computepr, with their header and F1 output names
+PR_OUTPUTS = [
+    (genpr_dt, "Type", "Type", "F1_Type.txt", None),
+    (genpr_dtp, "TypePlace", "Type+Place", "F1_TypePlace.txt", None),
+    (genpr_dtps, "TypePlaceStatus", "Type+Place+Status", "F1_TypePlaceStatus.txt", None),
+    (genpr_dtpsu, "TypePlaceStatusUrgency", "Type+Place+Status+Urgency",
+     "_F1_TypePlaceStatusUrgency.txt", "F1_TypeTypePlaceStatusUrgency"),
+    (genpr_dtpsr, "TypePlaceStatusResolution", "Type+Place+Status+Resolution",
+     "_F1_TypePlaceStatusResolution.txt", None),
+    (genpr_dtpsur, "TypePlaceStatusUrgencyResolution", "Type+Place+Status+Urgency+Resolution",
+     "_F1_TypePlaceStatusUrgencyResolution.txt", None),
+]
+
+
+def prepare_system(args, referenceBase, referenceTable, systemPath, outputDir, fnprefix, edl_subm, edl_ref_index=None):
+    """Reads one system output against the reference table with gravity, creating outputDir and
+    writing the SEC diagnostic scores there. Returns the submission table (getsubmissionBase),
+    the submission table with gravity and the threshold of the system."""
     referencePath = args.ground_truth
     referenceFilelist = args.filelist
-    systemPath = args.system_output
-    outputDir = args.output_directory
-    systemName = args.system_name
     threshold = args.system_threshold
-    fnprefix = args.filename_prefix
     skipsecflag = args.skip_sec
-    altrefflag = args.altref
     nonils = args.nonils
-    computepr = args.computepr
     # create output directory
     try:
         if not os.path.exists(outputDir):
@@ -140,20 +250,10 @@ def main():
     except:
         sys.exit("CAN NOT CREATE OUTPUT DIRECTORY: " + outputDir)
 
-    # basic error checks -------------------------------------------------------
-    if not os.path.exists(referencePath):
-        sys.exit("PATH NOT FOUND: " + referencePath)
-
     if not os.path.exists(systemPath):
         sys.exit("PATH NOT FOUND: " + systemPath)
 
     gravity_func = gravity_choices[args.gravity]
-    ndcgmethod = ndcgmethod_choices[args.ndcgmethod]
-
-    referenceTable = getReference(
-        path=referencePath, gravity=gravity_func, filelist=referenceFilelist, altref=altrefflag, nonils=nonils
-    )
-
 
 # get threshold from the end of the json filename
     if threshold == 0.0:
@@ -166,10 +266,16 @@ def main():
             print("No threshold present in filename. Using 0.0")
 
 
-    systemTable = getsubmission(
-        filename=systemPath, gravity=gravity_func, filelist=referenceFilelist, threshold=threshold, nonils=nonils
+    # Place_KB_ID correction does not depend on gravity, so it is done once on the base table
+    systemBase, systemBlocks = getsubmissionBase(
+        filename=systemPath,
+        filelist=referenceFilelist,
+        nonils=nonils,
+        chunksize=SUBMISSION_CHUNKSIZE if args.stream_submission else None,
+        sec=True,
     )
-    systemTable = correctkbids(systemTable, referenceTable)
+    systemBase = correctkbids(systemBase, referenceTable)
+    systemTable = withgravity(thresholdsubmission(systemBase, referenceFilelist, threshold), gravity_func)
 
     if not skipsecflag:
         genSEC_results(
@@ -178,33 +284,72 @@ def main():
             referencePath,
             systemTable,
             edl_ref=args.edl_ref,
-            edl_subm=args.edl_subm,
+            edl_subm=edl_subm,
+            sentiments=referenceBase["sentiments"],
+            edl_submission_docs=args.edl_submission_docs,
+            cachedir=args.reference_cache,
+            nil_match=args.nil_match,
+            blocks=systemBlocks,
+            edl_ref_index=edl_ref_index,
         )
-
-    referenceNDCG = getreferenceNDCG(referenceTable)
-    myndcg, k = genNDCG(referenceNDCG, systemTable, breakties="standard", method=ndcgmethod)
-    genNDCG_results(
-        os.path.join(outputDir, fnprefix + "standard_nDCG_Scores.txt"), systemName, myndcg, k
-    )
-    genNDCGplot(
-        os.path.join(outputDir, fnprefix + "standard_curve_nDCG" + ".pdf"), systemName, k, myndcg
+    return systemBase, systemTable, threshold
+
+
+def parse_thresholds(values):
+    """The thresholds of --threshold-sweep, given as numbers or inclusive start:stop:step ranges."""
+    thresholds = []
+    for value in values:
+        try:
+            if ":" in value:
+                start, stop, step = [float(x) for x in value.split(":")]
+                if step <= 0:
+                    raise ValueError(value)
+                count = int(np.floor((stop - start) / step + 1e-9)) + 1
+                thresholds += [round(start + i * step, 10) for i in range(max(count, 0))]
+            else:
+                thresholds.append(float(value))
+        except ValueError:
+            sys.exit("INVALID THRESHOLD: " + value)
+    return thresholds
+
+
+def write_threshold_sweep(args, referenceTable, systemBase, outputDir, fnprefix):
+    """Writes the threshold_sweep of the --threshold-sweep thresholds, if any, to outputDir."""
+    if not args.threshold_sweep:
+        return
+    sweep = threshold_sweep(
+        referenceTable,
+        withgravity(systemBase, gravity_choices[args.gravity]),
+        args.threshold_sweep,
+        NDCG_BREAKTIES,
+        ndcgmethod_choices[args.ndcgmethod],
+        args.precisionn_cutoffs,
     )
+    sweep.to_csv(os.path.join(outputDir, fnprefix + "threshold_sweep.txt"), sep="\t")
 
-    myndcg, k = genNDCG(referenceNDCG, systemTable, breakties="vindictive", method=ndcgmethod)
-    genNDCG_results(
-        os.path.join(outputDir, fnprefix + "vindictive_nDCG_Scores.txt"), systemName, myndcg, k
-    )
-    genNDCGplot(
-        os.path.join(outputDir, fnprefix + "vindictive_curve_nDCG" + ".pdf"), systemName, k, myndcg
-    )
 
-    myndcg, k = genNDCG(referenceNDCG, systemTable, breakties="forgiving", method=ndcgmethod)
-    genNDCG_results(
-        os.path.join(outputDir, fnprefix + "forgiving_nDCG_Scores.txt"), systemName, myndcg, k
+def score_system(args, referenceBase, systemPath, systemName, outputDir, fnprefix, edl_subm, edl_ref_index=None):
+    """Scores one system output against the loaded reference (getReferenceBase), writing the
+    output files to outputDir. The other options are taken from the parsed arguments args."""
+    computepr = args.computepr
+    ndcgmethod = ndcgmethod_choices[args.ndcgmethod]
+    referenceTable = referenceWithGravity(referenceBase, gravity_choices[args.gravity])
+    systemBase, systemTable, threshold = prepare_system(
+        args, referenceBase, referenceTable, systemPath, outputDir, fnprefix, edl_subm, edl_ref_index
     )
-    genNDCGplot(
-        os.path.join(outputDir, fnprefix + "forgiving_curve_nDCG" + ".pdf"), systemName, k, myndcg
+
+    referenceNDCG = getreferenceNDCG(referenceTable)
+    ndcgcurves, k = genNDCG_variants(
+        referenceNDCG, systemTable, breakties=NDCG_BREAKTIES, methods=[ndcgmethod]
     )
+    for breakties in NDCG_BREAKTIES:
+        myndcg = ndcgcurves[(breakties, ndcgmethod)]
+        genNDCG_results(
+            os.path.join(outputDir, fnprefix + breakties + "_nDCG_Scores.txt"), systemName, myndcg, k
+        )
+        genNDCGplot(
+            os.path.join(outputDir, fnprefix + breakties + "_curve_nDCG" + ".pdf"), systemName, k, myndcg
+        )
 
     genMAPMAR_results(
         os.path.join(outputDir, fnprefix + "DiagnosticScores.txt"),
@@ -213,93 +358,292 @@ def main():
         systemTable,
     )
 
-    myprecisionN = precisionN(referenceNDCG, systemTable)
+    myprecisionN = precisionN(referenceNDCG, systemTable, cutoffs=args.precisionn_cutoffs)
     genprecisionN_results(
         os.path.join(outputDir, fnprefix + "precisionN.txt"), systemName, myprecisionN
     )
+    write_threshold_sweep(args, referenceTable, systemBase, outputDir, fnprefix)
 
 
     if computepr:
     # Precision/Recall Curves:
 
-        referenceTable = getReference(
-            path=referencePath, gravity=boolean_gravity, filelist=referenceFilelist, altref=altrefflag, nonils=nonils
+        referenceTable = referenceWithGravity(referenceBase, boolean_gravity_column)
+        systemTable = withgravity(systemBase, boolean_gravity_column)
+        alignment = frame_alignment(systemTable, referenceTable)
+
+        optimal = []
+        for genpr_eqclass, eqclass, headerclass, f1filename, f1label in PR_OUTPUTS:
+            merged = genpr_eqclass(systemTable, referenceTable, threshold, alignment)
+            scores = precision_recall_scores(merged.label.values, merged.Confidence.values, threshold)
+            header='"{}" Precision-Recall curve for {}'.format(headerclass, systemName)
+            plotpr(os.path.join(outputDir, fnprefix + "prcurve" + eqclass + ".pdf"), merged, header,
+                   sysname=systemName, scores=scores)
+            genF1_results(os.path.join(outputDir, fnprefix + f1filename), eqclass, scores, f1label)
+            optimal.append((eqclass, scores))
+        genOptimalF1_results(os.path.join(outputDir, fnprefix + "OptimalF1.txt"), optimal)
+
+
+def read_manifest(manifest):
+    """The (system name, system output, EDL submission, filename prefix) of every line of a tab
+    separated manifest. The last two are optional; empty lines and lines starting with # are
+    skipped. Every system name must be usable as the name of its output subdirectory."""
+    try:
+        with open(manifest, newline="") as f:
+            rows = list(csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE))
+    except:
+        sys.exit("CAN NOT OPEN MANIFEST FILE: " + manifest)
+
+    systems, names = [], set()
+    for row in rows:
+        if not row or not row[0].strip() or row[0].startswith("#"):
+            continue
+        if not 2 <= len(row) <= 4:
+            sys.exit("INVALID MANIFEST LINE: " + "\t".join(row))
+        name, systemPath, edl_subm, fnprefix = (row + ["", ""])[:4]
+        if name in (".", "..") or os.path.basename(name) != name:
+            sys.exit("INVALID SYSTEM NAME IN MANIFEST: " + name)
+        if os.path.normcase(name) in names:
+            sys.exit("DUPLICATE SYSTEM NAME IN MANIFEST: " + name)
+        names.add(os.path.normcase(name))
+        systems.append((name, systemPath, edl_subm, fnprefix))
+    return systems
+
+
+# the parsed arguments and loaded reference of a batch run, inherited by the scoring processes
+BATCH = {}
+
+
+def system_failure(func, *args):
+    """func(*args), and why it failed to score a system (or None)."""
+    try:
+        return func(*args), None
+    except SystemExit as e:
+        return None, str(e.code)
+    except Exception:
+        return None, traceback.format_exc()
+
+
+def score_batch_system(system):
+    """score_system of one manifest system (read_manifest) into its own subdirectory of the
+    output directory. Returns the system name and why it could not be scored, or None."""
+    name, systemPath, edl_subm, fnprefix = system
+    args = BATCH["args"]
+    print("Scoring system: " + name)
+    return name, system_failure(
+        score_system,
+        args,
+        BATCH["reference"],
+        systemPath,
+        name,
+        os.path.join(args.output_directory, name),
+        fnprefix or args.filename_prefix,
+        edl_subm or args.edl_subm,
+        BATCH["edl_ref_index"],
+    )[1]
+
+
+def score_stacked(args, referenceBase, systems):
+    """Scores the manifest systems (read_manifest) from one stacked submission table, writing
+    the outputs of every system to its own subdirectory of the output directory and the scores
+    of all of them to cross_system_scores.txt. Returns the systems that could not be read."""
+    ndcgmethod = ndcgmethod_choices[args.ndcgmethod]
+    referenceTable = referenceWithGravity(referenceBase, gravity_choices[args.gravity])
+    names, outputDirs, fnprefixes, bases, tables, thresholds, failed = [], [], [], [], [], [], []
+    for name, systemPath, edl_subm, fnprefix in systems:
+        print("Scoring system: " + name)
+        outputDir = os.path.join(args.output_directory, name)
+        fnprefix = fnprefix or args.filename_prefix
+        prepared, error = system_failure(
+            prepare_system,
+            args,
+            referenceBase,
+            referenceTable,
+            systemPath,
+            outputDir,
+            fnprefix,
+            edl_subm or args.edl_subm,
+            BATCH["edl_ref_index"],
         )
-        systemTable = getsubmission(
-            filename=systemPath, gravity=boolean_gravity, filelist=referenceFilelist, nonils=nonils
+        if error is not None:
+            failed.append((name, error))
+            continue
+        names.append(name)
+        outputDirs.append(outputDir)
+        fnprefixes.append(fnprefix)
+        bases.append(prepared[0])
+        tables.append(prepared[1])
+        thresholds.append(prepared[2])
+    if not names:
+        return failed
+
+    systemTable = stacksubmissions(tables, names)
+    referenceNDCG = getreferenceNDCG(referenceTable)
+    ndcg = genNDCG_systems(referenceNDCG, systemTable, names, NDCG_BREAKTIES, [ndcgmethod])
+    mapmar = genMAPMAR_systems(referenceTable, systemTable, names)
+    precision = precisionN_systems(referenceNDCG, systemTable, names, args.precisionn_cutoffs)
+    for name, outputDir, fnprefix in zip(names, outputDirs, fnprefixes):
+        for breakties in NDCG_BREAKTIES:
+            myndcg = ndcg[(ndcg["system_id"] == name).values & (ndcg["breakties"] == breakties).values]
+            k = myndcg["k"].tolist()
+            genNDCG_results(
+                os.path.join(outputDir, fnprefix + breakties + "_nDCG_Scores.txt"), name, myndcg["nDCG"].tolist(), k
+            )
+            genNDCGplot(
+                os.path.join(outputDir, fnprefix + breakties + "_curve_nDCG" + ".pdf"), name, k, myndcg["nDCG"].tolist()
+            )
+        mymapmar = mapmar[(mapmar["system_id"] == name).values]
+        writeMAPMAR_results(
+            os.path.join(outputDir, fnprefix + "DiagnosticScores.txt"),
+            name,
+            list(zip(mymapmar["metric"].tolist(), mymapmar["value"].tolist())),
+        )
+        myprecisionN = precision[(precision["system_id"] == name).values]
+        genprecisionN_results(
+            os.path.join(outputDir, fnprefix + "precisionN.txt"),
+            name,
+            list(zip(myprecisionN["N"].tolist(), myprecisionN["precision"].tolist())),
         )
 
-        systemTable = correctkbids(systemTable, referenceTable)
-
-
-
-
-        merged = genpr_dt(systemTable,referenceTable, threshold)
-        header='"Type" Precision-Recall curve for {}'.format(systemName)
-        plotpr(os.path.join(outputDir, fnprefix + "prcurveType.pdf"), merged, header, sysname=systemName)
-
-        filename = os.path.join(outputDir, fnprefix + "F1_Type.txt")
-        with open(filename, "w") as F_results_file:
-            F_results_file.write("F1_Type:\t" + str(f1_score(merged.label, merged.pred)) + "\n")
-            F_results_file.write("Precision_Type:\t" + str(precision_score(merged.label, merged.pred)) + "\n")
-            F_results_file.write("Recall_Type:\t" + str(recall_score(merged.label, merged.pred)) + "\n")
-
-
-        merged = genpr_dtp(systemTable,referenceTable, threshold)
-        header='"Type+Place" Precision-Recall curve for {}'.format(systemName)
-        plotpr(os.path.join(outputDir, fnprefix + "prcurveTypePlace.pdf"), merged, header, sysname=systemName)
-
-        filename = os.path.join(outputDir, fnprefix + "F1_TypePlace.txt")
-        with open(filename, "w") as F_results_file:
-            F_results_file.write("F1_TypePlace:\t" + str(f1_score(merged.label, merged.pred)) + "\n")
-            F_results_file.write("Precision_TypePlace:\t" + str(precision_score(merged.label, merged.pred)) + "\n")
-            F_results_file.write("Recall_TypePlace:\t" + str(recall_score(merged.label, merged.pred)) + "\n")
-
-
-        merged = genpr_dtps(systemTable,referenceTable, threshold)
-        header='"Type+Place+Status" Precision-Recall curve for {}'.format(systemName)
-        plotpr(os.path.join(outputDir, fnprefix + "prcurveTypePlaceStatus.pdf"), merged, header, sysname=systemName)
-
-        filename = os.path.join(outputDir, fnprefix + "F1_TypePlaceStatus.txt")
-        with open(filename, "w") as F_results_file:
-            F_results_file.write("F1_TypePlaceStatus:\t" + str(f1_score(merged.label, merged.pred)) + "\n")
-            F_results_file.write("Precision_TypePlaceStatus:\t" + str(precision_score(merged.label, merged.pred)) + "\n")
-            F_results_file.write("Recall_TypePlaceStatus:\t" + str(recall_score(merged.label, merged.pred)) + "\n")
-
+    # the scores of every system side by side: MAP/MAR, nDCG and precision at the cutoffs, PR
+    cross = [summary_scores(mapmar, ndcg, precision, args.precisionn_cutoffs)]
+    for name, outputDir, fnprefix, systemBase in zip(names, outputDirs, fnprefixes, bases):
+        write_threshold_sweep(args, referenceTable, systemBase, outputDir, fnprefix)
+
+    if args.computepr:
+        referenceTable = referenceWithGravity(referenceBase, boolean_gravity_column)
+        systemTable = withgravity(stacksubmissions(bases, names), boolean_gravity_column)
+        alignment = frame_alignment(systemTable, referenceTable)
+        optimal = [[] for name in names]
+        for genpr_eqclass, eqclass, headerclass, f1filename, f1label in PR_OUTPUTS:
+            merged = genpr(alignment, eqclass, thresholds, names)
+            system = merged["system_id"].values
+            # the curve and scores of every system come from its own confidence sort, the
+            # cross-system scores from one pass over all of them
+            for i, (name, outputDir, fnprefix) in enumerate(zip(names, outputDirs, fnprefixes)):
+                mymerged = merged[system == name]
+                scores = precision_recall_scores(mymerged.label.values, mymerged.Confidence.values, thresholds[i])
+                header = '"{}" Precision-Recall curve for {}'.format(headerclass, name)
+                plotpr(os.path.join(outputDir, fnprefix + "prcurve" + eqclass + ".pdf"), mymerged, header,
+                       sysname=name, scores=scores)
+                genF1_results(os.path.join(outputDir, fnprefix + f1filename), eqclass, scores, f1label)
+                optimal[i].append((eqclass, scores))
+            prscores = precision_recall_systems(merged, thresholds, names)
+            for score in ["F1", "Precision", "Recall", "AP"]:
+                cross.append(
+                    pd.DataFrame(
+                        {
+                            "system_id": prscores["system_id"].values,
+                            "metric": score + "_" + eqclass,
+                            "value": prscores[score].values,
+                        }
+                    )
+                )
+            for score in ["Threshold", "F1", "Precision", "Recall"]:
+                cross.append(
+                    pd.DataFrame(
+                        {
+                            "system_id": names,
+                            "metric": "Optimal" + score + "_" + eqclass,
+                            "value": [system_optimal[-1][1]["Optimal" + score] for system_optimal in optimal],
+                        }
+                    )
+                )
+        for name, outputDir, fnprefix, system_optimal in zip(names, outputDirs, fnprefixes, optimal):
+            genOptimalF1_results(os.path.join(outputDir, fnprefix + "OptimalF1.txt"), system_optimal)
+
+    pd.concat(cross, ignore_index=True, sort=False)[["system_id", "metric", "value"]].to_csv(
+        os.path.join(args.output_directory, args.filename_prefix + "cross_system_scores.txt"),
+        sep="\t",
+        index=False,
+    )
+    return failed
+
+
+def score_manifest(args, referenceBase):
+    """Scores every system of the manifest against the loaded reference, on a pool of forked
+    processes sharing it where fork is available, or all at once with --stacked."""
+    systems = read_manifest(args.manifest)
+    for name, systemPath, edl_subm, fnprefix in systems:
+        if not os.path.exists(systemPath):
+            sys.exit("PATH NOT FOUND: " + systemPath)
+
+    BATCH["args"] = args
+    BATCH["reference"] = referenceBase
+    BATCH["edl_ref_index"] = (
+        edl_index(args.edl_ref, args.reference_cache, args.nil_match)
+        if args.edl_ref and not args.skip_sec
+        else None
+    )
 
-        merged = genpr_dtpsu(systemTable,referenceTable, threshold)
-        header='"Type+Place+Status+Urgency" Precision-Recall curve for {}'.format(systemName)
-        plotpr(os.path.join(outputDir, fnprefix + "prcurveTypePlaceStatusUrgency.pdf"), merged, header, sysname=systemName)
+    if args.stacked:
+        failed = score_stacked(args, referenceBase, systems)
+    else:
+        failed = run_manifest(args, systems)
+    for name, error in failed:
+        print("FAILED TO SCORE SYSTEM " + name + ": " + error)
+    if failed:
+        sys.exit("FAILED TO SCORE " + str(len(failed)) + " OF " + str(len(systems)) + " SYSTEMS")
 
-        filename = os.path.join(outputDir, fnprefix + "_F1_TypePlaceStatusUrgency.txt")
-        with open(filename, "w") as F_results_file:
-            F_results_file.write("F1_TypeTypePlaceStatusUrgency:\t" + str(f1_score(merged.label, merged.pred)) + "\n")
-            F_results_file.write("Precision_TypePlaceStatusUrgency:\t" + str(precision_score(merged.label, merged.pred)) + "\n")
-            F_results_file.write("Recall_TypePlaceStatusUrgency:\t" + str(recall_score(merged.label, merged.pred)) + "\n")
 
+def run_manifest(args, systems):
+    """score_batch_system of every manifest system, on a pool of forked processes. Returns the
+    systems that could not be scored."""
+    workers = min(args.workers or os.cpu_count() or 1, len(systems))
+    try:
+        context = multiprocessing.get_context("fork")
+    except ValueError:
+        context = None
+    if workers <= 1 or context is None:
+        results = [score_batch_system(system) for system in systems]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            results = list(pool.map(score_batch_system, systems))
+    return [(name, error) for name, error in results if error is not None]
 
-        merged = genpr_dtpsr(systemTable,referenceTable, threshold)
-        header='"Type+Place+Status+Resolution" Precision-Recall curve for {}'.format(systemName)
-        plotpr(os.path.join(outputDir, fnprefix + "prcurveTypePlaceStatusResolution.pdf"), merged, header, sysname=systemName)
 
-        filename = os.path.join(outputDir, fnprefix + "_F1_TypePlaceStatusResolution.txt")
-        with open(filename, "w") as F_results_file:
-            F_results_file.write("F1_TypePlaceStatusResolution:\t" + str(f1_score(merged.label, merged.pred)) + "\n")
-            F_results_file.write("Precision_TypePlaceStatusResolution:\t" + str(precision_score(merged.label, merged.pred)) + "\n")
-            F_results_file.write("Recall_TypePlaceStatusResolution:\t" + str(recall_score(merged.label, merged.pred)) + "\n")
+def main():
+    debug = False
 
+    parser = define_parser()
+    args = parser.parse_args()
+    print(args)
+    print("skipsec is: ", str(args.skip_sec))
 
-        merged = genpr_dtpsur(systemTable,referenceTable, threshold)
-        header='"Type+Place+Status+Urgency+Resolution" Precision-Recall curve for {}'.format(systemName)
-        plotpr(os.path.join(outputDir, fnprefix + "prcurveTypePlaceStatusUrgencyResolution.pdf"), merged, header, sysname=systemName)
+    if not args.manifest and not (args.system_output and args.system_name):
+        parser.error("the following arguments are required: -s/--system-output, -m/--system-name")
+    if args.stacked and not args.manifest:
+        parser.error("--stacked requires --manifest")
+    if args.threshold_sweep:
+        args.threshold_sweep = parse_thresholds(args.threshold_sweep)
 
-        filename = os.path.join(outputDir, fnprefix + "_F1_TypePlaceStatusUrgencyResolution.txt")
-        with open(filename, "w") as F_results_file:
-            F_results_file.write("F1_TypePlaceStatusUrgencyResolution:\t" + str(f1_score(merged.label, merged.pred)) + "\n")
-            F_results_file.write("Precision_TypePlaceStatusUrgencyResolution:\t" + str(precision_score(merged.label, merged.pred)) + "\n")
-            F_results_file.write("Recall_TypePlaceStatusUrgencyResolution:\t" + str(recall_score(merged.label, merged.pred)) + "\n")
+    referencePath = args.ground_truth
+    # basic error checks -------------------------------------------------------
+    if not os.path.exists(referencePath):
+        sys.exit("PATH NOT FOUND: " + referencePath)
 
+    referenceBase = getReferenceBase(
+        path=referencePath,
+        filelist=args.filelist,
+        altref=args.altref,
+        nonils=args.nonils,
+        cachedir=args.reference_cache,
+        annotators=args.annotator_choice,
+        workers=args.reference_workers,
+    )
 
+    if args.manifest:
+        score_manifest(args, referenceBase)
+    else:
+        score_system(
+            args,
+            referenceBase,
+            args.system_output,
+            args.system_name,
+            args.output_directory,
+            args.filename_prefix,
+            args.edl_subm,
+        )
 
     print("Success!")
 
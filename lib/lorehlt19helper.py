@@ -4,9 +4,14 @@ __date__ = "09/04/2019"
 
 import configparser
 import csv
+import functools
 import glob
+import hashlib
+import multiprocessing
 import os
+import pickle
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
 import jsonschema
 import matplotlib
@@ -16,13 +21,10 @@ import pandas as pd
 import simplejson as json
 from matplotlib.backends.backend_pdf import PdfPages
 from pandas.io.json import json_normalize
-from sklearn.metrics import average_precision_score, recall_score
-from sklearn.metrics import precision_recall_curve
-from sklearn.metrics import precision_score, recall_score, f1_score
 import matplotlib.pyplot as plt
-from sklearn.metrics import average_precision_score
 
-from lib.sec_helper import get_SEC_ref, SEC_scoring, nil_mapper
+from lib.sec_helper import SEC_scores, edl_index, flatten_SEC, nil_mapper, NIL_MATCH_POLICIES
+from lib.submission_validator import getvalidator, validatesubmission
 
 import random
 random.seed(a=1)
@@ -38,13 +40,109 @@ except:
     sys.exit("CAN NOT OPEN CONFIG FILE: " + os.path.join(os.path.dirname(base_dir), "config.ini"))
 
 
-def getReference(path, gravity, filelist, altref=0, nonils=False):
+REFERENCE_COLUMNS = [
+    "doc_id",
+    "frame_id",
+    "kb_id",
+    "user_id",
+    "type",
+    "urgent",
+    "unresolved",
+    "current",
+    "gravity",
+    "frame_count",
+    "status",
+]
+
+
+# bump when the parsed reference changes, to invalidate existing caches
+REFERENCE_CACHE_VERSION = 2
+
+
+def referenceFingerprint(path, filelist, altref=0, nonils=False, annotators="perfile"):
+    """Hash of the reference files (names, sizes and modification times) and of the
+    options that change the parsed reference. Gravity is not part of it, since the
+    cached base table is gravity independent."""
+    fingerprint = hashlib.sha1()
+    fingerprint.update(
+        repr(
+            (
+                REFERENCE_CACHE_VERSION,
+                pd.__version__,
+                os.path.abspath(path),
+                bool(altref),
+                bool(nonils),
+                annotators,
+            )
+        ).encode()
+    )
+    for subdir in ["needs", "issues", "sentiments", "speech"]:
+        for file_ in sorted(glob.glob(os.path.join(path, subdir, "*.tab"))):
+            stat = os.stat(file_)
+            fingerprint.update(
+                repr((subdir, os.path.basename(file_), stat.st_size, stat.st_mtime_ns)).encode()
+            )
+    if filelist:
+        try:
+            with open(filelist, "rb") as f:
+                fingerprint.update(f.read())
+        except:
+            sys.exit("FAILED TO OPEN REFERENCE LIST FILE: " + filelist)
+    return fingerprint.hexdigest()
+
+
+def getReferenceBase(
+    path, filelist, altref=0, nonils=False, cachedir=None, annotators="perfile", workers=None
+):
+    """Parses the reference once, without gravity. Gravity specific tables are
+    derived from it with referenceWithGravity. With cachedir the parsed reference
+    is kept on disk and reused while the reference files and options are unchanged."""
+    if not cachedir:
+        return readReferenceBase(
+            path, filelist, altref=altref, nonils=nonils, annotators=annotators, workers=workers
+        )
+
+    cachefile = os.path.join(
+        cachedir,
+        "reference_" + referenceFingerprint(path, filelist, altref, nonils, annotators) + ".pkl",
+    )
+    if os.path.exists(cachefile):
+        try:
+            with open(cachefile, "rb") as f:
+                referenceBase = pickle.load(f)
+            print("Using cached reference: " + cachefile)
+            return referenceBase
+        except Exception as e:
+            print("Ignoring unreadable reference cache " + cachefile + ": " + str(e))
+
+    referenceBase = readReferenceBase(
+        path, filelist, altref=altref, nonils=nonils, annotators=annotators, workers=workers
+    )
+    try:
+        if not os.path.exists(cachedir):
+            os.makedirs(cachedir)
+        tmpfile = cachefile + "." + str(os.getpid())
+        with open(tmpfile, "wb") as f:
+            pickle.dump(referenceBase, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpfile, cachefile)
+    except OSError as e:
+        print("CAN NOT WRITE REFERENCE CACHE: " + cachefile + ": " + str(e))
+    return referenceBase
+
+
+def readReferenceBase(path, filelist, altref=0, nonils=False, annotators="perfile", workers=None):
     random.seed(a=1)
-    speechref = getSpeechReference(path, gravity)
+    speechref = getSpeechReference(path, workers=workers)
+    sentiments = getSentiments(path, workers=workers)
+    textref = getTextReference(
+        path, altref=altref, annotators=annotators, workers=workers, sentiments=sentiments
+    )
     if speechref is not None:
-        reference = pd.concat([getTextReference(path, gravity, altref=altref), speechref], sort=True)
+        reference = pd.concat([textref, speechref], sort=True)
+        columns = sorted(REFERENCE_COLUMNS)
     else:
-        reference = getTextReference(path, gravity, altref=altref)
+        reference = textref
+        columns = REFERENCE_COLUMNS
     if filelist:
         print("Reference filelist present. Subsetting...")
         try:
@@ -56,62 +154,164 @@ def getReference(path, gravity, filelist, altref=0, nonils=False):
     if nonils:
         print("Removing NILs from reference.")
         reference = reference[~reference.kb_id.str.contains('nil', case=False)]
-    reference.reset_index(drop=True)
-    return reference
+    return {"reference": reference, "columns": columns, "sentiments": sentiments}
 
 
-def getTextReference(path, gravity, altref=0):
-    # path = # use your path
-    allFiles = glob.glob(path + "/needs/*.tab") + glob.glob(path + "/issues/*.tab")
-    sentiment_files = glob.glob(path + "/sentiments/*.tab")
-    # print(allFiles)
-    reference = pd.DataFrame(
-        columns=[
-            "description",
-            "doc_id",
-            "frame_id",
-            "frame_type",
-            "issue_status",
-            "issue_type",
-            "kb_id",
-            "need_status",
-            "need_type",
-            "place_id",
-            "proxy_status",
-            "reported_by",
-            "resolution_status",
-            "resolved_by",
-            "scope",
-            "severity",
-            "user_id",
-        ]
+def referenceWithGravity(referenceBase, gravity):
+    reference = withgravity(referenceBase["reference"], gravity)
+    return reference[referenceBase["columns"]]
+
+
+def getReference(
+    path, gravity, filelist, altref=0, nonils=False, cachedir=None, annotators="perfile", workers=None
+):
+    referenceBase = getReferenceBase(
+        path,
+        filelist,
+        altref=altref,
+        nonils=nonils,
+        cachedir=cachedir,
+        annotators=annotators,
+        workers=workers,
     )
-    list_ = []
-    for file_ in allFiles:
-        df = pd.read_csv(
-            file_,
-            index_col=None,
-            header=0,
-            sep="\t",
-            quoting=csv.QUOTE_NONE,
-            dtype={"doc_id": object, "kb_id": object},
-        )
-        myannotators = df.user_id.unique().tolist()
-        if len(myannotators) > 1:
-            if altref:
-                myannotators.remove(random.choice(myannotators))
-                myannotator = myannotators[0]
-            else:
-                myannotator = random.choice(myannotators)
+    return referenceWithGravity(referenceBase, gravity)
+
+
+def withgravity(table, gravity):
+    """Copy of a reference or submission table with the gravity column added. gravity is a
+    column gravity function (see GRAVITY_COLUMNS) or a function applied to every row."""
+    gravity = GRAVITY_COLUMNS.get(gravity, gravity)
+    if gravity in GRAVITY_COLUMNS.values():
+        values = gravity(table)
+    else:
+        values = table.apply(gravity, axis=1).values
+    table = table.copy()
+    table.insert(table.columns.get_loc("frame_count"), "gravity", values)
+    return table
+
+
+TEXT_REFERENCE_TAB_COLUMNS = [
+    "description",
+    "doc_id",
+    "frame_id",
+    "frame_type",
+    "issue_status",
+    "issue_type",
+    "kb_id",
+    "need_status",
+    "need_type",
+    "place_id",
+    "proxy_status",
+    "reported_by",
+    "resolution_status",
+    "resolved_by",
+    "scope",
+    "severity",
+    "user_id",
+]
+
+# "perfile" seeds the annotator choice of every reference file from its name, so
+# files can be read in any order; "sequential" draws from the global random
+# stream in glob order, reproducing the choices of earlier releases.
+ANNOTATOR_CHOICES = ["perfile", "sequential"]
+
+
+def mapfiles(func, files, workers=None):
+    """[func(f) for f in files], on a pool of workers processes when there are several. By
+    default there is one per CPU, or none in processes that are themselves workers of a pool
+    (e.g. the manifest scoring processes), so pools are not nested."""
+    if not workers:
+        if multiprocessing.current_process().name != "MainProcess":
+            workers = 1
         else:
+            workers = os.cpu_count() or 1
+    if workers == 1 or len(files) < 2:
+        return [func(file_) for file_ in files]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(func, files, chunksize=max(1, len(files) // (4 * workers))))
+
+
+def readReferenceTab(file_, **kwargs):
+    return pd.read_csv(
+        file_,
+        index_col=None,
+        header=0,
+        sep="\t",
+        quoting=csv.QUOTE_NONE,
+        dtype={"doc_id": object, "kb_id": object},
+        **kwargs
+    )
+
+
+def getSentiments(path, workers=None):
+    """All sentiment annotations of the reference, read once and shared by the text
+    reference (emotion values of the frames) and SEC scoring."""
+    sentiment_files = glob.glob(path + "/sentiments/*.tab")
+    sentiment_df_list = mapfiles(
+        functools.partial(readReferenceTab, na_values=["none"]), sentiment_files, workers
+    )
+    return pd.concat(sentiment_df_list, axis=0, ignore_index=True)
+
+
+def groupsentiments(sentiments):
+    """Emotion values of every (doc_id, target) of the sentiment annotations, comma joined.
+    Some frame ids are annotated more than once."""
+    grouped = sentiments.groupby(["doc_id", "target"])
+    group = grouped.ngroup().values
+    order = np.argsort(group, kind="mergesort")
+    emotions = sentiments["emotion_value"].values[order].astype(object)
+    present = pd.notnull(emotions)
+    emotions[present] = "," + emotions[present].astype(str).astype(object)
+    emotions[~present] = ""
+    # concatenate the ","-prefixed values of every group at once; rows without a group
+    # (ngroup -1, missing doc_id or target) sort first and are left out, as in groupby
+    starts = np.flatnonzero(np.diff(np.r_[-1, group[order]]))
+    grouped = grouped.size().index.to_frame(index=False)
+    grouped["emotion_value"] = pd.Series(np.add.reduceat(emotions, starts)).str[1:].values
+    return grouped
+
+
+def chooseAnnotator(df, altref, rng):
+    myannotators = df.user_id.unique().tolist()
+    if len(myannotators) > 1:
+        if altref:
+            myannotators.remove(rng.choice(myannotators))
             myannotator = myannotators[0]
+        else:
+            myannotator = rng.choice(myannotators)
+    else:
+        myannotator = myannotators[0]
+    return df[df.user_id == myannotator]
+
 
+def readAnnotatorTab(file_, altref=0):
+    return chooseAnnotator(readReferenceTab(file_), altref, random.Random(os.path.basename(file_)))
 
-        df = df[df.user_id == myannotator]
-        list_.append(df)
+
+def getTextReference(
+    path, gravity=None, altref=0, annotators="perfile", workers=None, sentiments=None
+):
+    # path = # use your path
+    allFiles = glob.glob(path + "/needs/*.tab") + glob.glob(path + "/issues/*.tab")
+    # print(allFiles)
+    if annotators == "perfile":
+        list_ = mapfiles(functools.partial(readAnnotatorTab, altref=altref), allFiles, workers)
+    elif annotators == "sequential":
+        list_ = [
+            chooseAnnotator(df, altref, random) for df in mapfiles(readReferenceTab, allFiles, workers)
+        ]
+    else:
+        sys.exit("UNKNOWN ANNOTATOR CHOICE: " + str(annotators))
     if not list_:
         sys.exit("Text reference list is empty. Please check the reference folder and try again.")
-    reference = reference.append(list_, sort=True)
+    reference = pd.concat(list_, sort=True)
+    # the tab columns are object typed, and present even when no file has them (e.g. no issues files)
+    for column in TEXT_REFERENCE_TAB_COLUMNS:
+        if column in reference.columns:
+            reference[column] = reference[column].astype(object)
+        else:
+            reference[column] = np.full(reference.shape[0], np.nan, dtype=object)
+    reference = reference[sorted(reference.columns)]
     d = {
         "1_discomfort": 1,
         "2_injury": 2,
@@ -140,11 +340,15 @@ def getTextReference(path, gravity, altref=0):
         0: 0,
     }
     reference["scope"] = reference["scope"].map(d)
-    reference["status"] = reference[["need_status", "issue_status"]].apply(
-        lambda x: x["need_status"] if pd.isnull(x["issue_status"]) else x["issue_status"], axis=1
+    reference["status"] = np.where(
+        reference["issue_status"].isnull().values,
+        reference["need_status"].values,
+        reference["issue_status"].values,
     )
-    reference["type"] = reference[["issue_type", "need_type"]].apply(
-        lambda x: x["issue_type"] if pd.isnull(x["need_type"]) else x["need_type"], axis=1
+    reference["type"] = np.where(
+        reference["need_type"].isnull().values,
+        reference["issue_type"].values,
+        reference["need_type"].values,
     )
     reference.drop(
         [
@@ -165,9 +369,7 @@ def getTextReference(path, gravity, altref=0):
 
     # d = {'True': True, 'False': False, np.nan: False}
     # reference['urgency_status'].replace(d, inplace = True)
-    reference["urgent"] = reference[["scope", "severity"]].apply(
-        lambda x: True if x["scope"] > 1 and x["severity"] > 1 else False, axis=1
-    )
+    reference["urgent"] = (reference["scope"] > 1) & (reference["severity"] > 1)
 
     d = {"insufficient": True, "sufficient": False, np.nan: False}
     reference["unresolved"] = reference["resolution_status"].map(d)
@@ -175,58 +377,30 @@ def getTextReference(path, gravity, altref=0):
     d = {"current": True, "past": False, "future": False, "not_current": False, np.nan: False}
     reference["current"] = reference["status"].map(d)
 
-    sentiment_df_list = []
-    for file_ in sentiment_files:
-        df = pd.read_csv(
-            file_,
-            index_col=None,
-            header=0,
-            sep="\t",
-            quoting=csv.QUOTE_NONE,
-            dtype={"doc_id": object, "kb_id": object},
-            na_values=["none"],
-        )
-        sentiment_df_list.append(df)
-    all_sentiments_df = pd.concat(sentiment_df_list, axis=0, ignore_index=True, sort=True)
-    # some frame ids are repeated, they need to be grouped
-    grouped = all_sentiments_df.groupby(["doc_id", "target"])
-    grouped_sentiments = grouped.aggregate(lambda x: tuple(x))
+    if sentiments is None:
+        sentiments = getSentiments(path, workers=workers)
     # merge with reference on target<->frame_id
     reference = pd.merge(
         reference,
-        grouped_sentiments,
+        groupsentiments(sentiments),
         how="left",
         left_on=["doc_id", "frame_id"],
         right_on=["doc_id", "target"],
-        suffixes=("", "_sentiment"),
     )
     reference["sentiments"] = reference["emotion_value"].str.split(",")
-    reference["gravity"] = reference.apply(gravity, axis=1)
     reference["frame_count"] = 1
-    reference = reference[
-        [
-            "doc_id",
-            "frame_id",
-            "kb_id",
-            "user_id",
-            "type",
-            "urgent",
-            "unresolved",
-            "current",
-            "gravity",
-            "frame_count",
-            "status",
-        ]
-    ]
-    return reference
+    if gravity is None:
+        return reference
+    return withgravity(reference, gravity)[REFERENCE_COLUMNS]
+
 
+def readSpeechTab(file_):
+    return pd.read_csv(file_, index_col=None, header=0, sep="\t", quoting=csv.QUOTE_NONE)
 
-def getSpeechReference(path, gravity):
+
+def getSpeechReference(path, gravity=None, workers=None):
     allFiles = glob.glob(path + "/speech/*.tab")
-    list_ = []
-    for file_ in allFiles:
-        df = pd.read_csv(file_, index_col=None, header=0, sep="\t", quoting=csv.QUOTE_NONE)
-        list_.append(df)
+    list_ = mapfiles(readSpeechTab, allFiles, workers)
     if not list_:
         print("Speech reference list is empty.")
         return None
@@ -267,9 +441,7 @@ def getSpeechReference(path, gravity):
     }
     reference["scope"] = reference["scope"].map(d)
 
-    reference["urgent"] = reference[["scope", "severity"]].apply(
-        lambda x: True if x["scope"] > 1 and x["severity"] > 1 else False, axis=1
-    )
+    reference["urgent"] = (reference["scope"] > 1) & (reference["severity"] > 1)
 
     d = {"Insufficent": True, "Insufficient/Unknown": True, "Sufficient": False, np.nan: False}
     reference["unresolved"] = reference["resolution_status"].map(d)
@@ -279,53 +451,120 @@ def getSpeechReference(path, gravity):
     reference["frame_count"] = 1
     reference["user_id"] = "Appn1"
     issue_types = ["regimechange", "crimeviolence", "terrorism" ]
-    reference["frame_type"] = reference["type"].apply(lambda x: "issue" if x in issue_types else "need")
+    reference["frame_type"] = np.where(reference["type"].isin(issue_types).values, "issue", "need")
     reference["emotion_value"] = np.NaN
-    reference["gravity"] = reference.apply(gravity, axis=1)
     reference = reference[~reference["kb_id"].isnull()]
     reference = reference[reference["kb_id"] != "NIL"]
-
-    reference = reference[
-        [
-            "doc_id",
-            "frame_id",
-            "kb_id",
-            "user_id",
-            "type",
-            "urgent",
-            "unresolved",
-            "current",
-            "gravity",
-            "frame_count",
-        ]
-    ]
-    return reference
-
-
-def getsubmission(filename, gravity, filelist, threshold=0.0, nonils=False):
-    base_dir = os.path.dirname(os.path.realpath(__file__))
-    schemafile = os.path.join(
-        os.path.dirname(base_dir), "schemas", "LoReHLT19-schema_V1.json"  # TODO update schema
-    )
-    try:
-        with open(schemafile, "r") as f:
-            schema_data = f.read()
-            schema = json.loads(schema_data)
-    except:
-        sys.exit("CAN NOT OPEN JSON SCHEMA FILE: " + schemafile)
-
+    if gravity is None:
+        return reference
+    return withgravity(reference, gravity)[REFERENCE_COLUMNS[:-1]]
+
+
+SUBMISSION_CHUNKSIZE = 10000
+
+
+def iterjsonarray(f, bufsize=1 << 20):
+    """Yields the elements of the top level JSON array in file f one at a time,
+    reading it bufsize characters at a time."""
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+
+    def skipws(buf, pos, eof):
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf) or eof:
+                return buf, pos, eof
+            chunk = f.read(bufsize)
+            buf, pos, eof = chunk, 0, not chunk
+
+    buf, pos, eof = skipws(buf, pos, eof)
+    if buf[pos:pos + 1] != "[":
+        raise jsonschema.ValidationError("top level of the submission is not of type 'array'")
+    pos += 1
+    first = True
+    while True:
+        buf, pos, eof = skipws(buf, pos, eof)
+        if buf[pos:pos + 1] == "]":
+            buf, pos, eof = skipws(buf, pos + 1, eof)
+            if pos < len(buf):
+                raise ValueError("Extra data after the submission array")
+            return
+        if not first:
+            if buf[pos:pos + 1] != ",":
+                raise ValueError("Expecting ',' delimiter")
+            buf, pos, eof = skipws(buf, pos + 1, eof)
+        while True:
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                end = None
+            # an element running up to the end of the buffer may continue in the file
+            if end is not None and (end < len(buf) or eof):
+                break
+            chunk = f.read(bufsize)
+            if not chunk:
+                if end is None:
+                    raise ValueError("Unterminated submission array")
+                eof = True
+                break
+            buf, pos = buf[pos:] + chunk, 0
+        pos = end
+        first = False
+        yield obj
+
+
+def streamsubmission(filename, chunksize=SUBMISSION_CHUNKSIZE, version="V1"):
+    """Validates the submission frame by frame while it is read and normalizes it
+    chunksize frames at a time, so the whole JSON object graph is never in memory."""
+    getvalidator(version, items=True)  # reports a missing schema before reading the submission
+    chunks = []
     try:
         with open(filename) as f:
-            d = json.load(f)
+            frames = []
+            for frame in iterjsonarray(f):
+                validatesubmission(frame, version, items=True)
+                frames.append(frame)
+                if len(frames) == chunksize:
+                    chunks.append(json_normalize(frames))
+                    frames = []
+            if frames or not chunks:
+                chunks.append(json_normalize(frames))
+    except jsonschema.ValidationError as e:
+        print(e)
+        sys.exit("ERROR: System submission json failed validation:\n" + str(e) + "\n")
     except:
         sys.exit("CAN NOT OPEN JSON SUBMISSION FILE: " + filename)
+    start = 0
+    for chunk in chunks:
+        chunk.index = pd.RangeIndex(start, start + chunk.shape[0])
+        start += chunk.shape[0]
+    return chunks
+
+
+def getsubmissionBase(filename, filelist, nonils=False, chunksize=None, version="V1", sec=False):
+    """Loads, validates and normalizes a submission once, without gravity or threshold.
+    Gravity specific tables are derived from it with withgravity. With chunksize
+    the submission is streamed (see streamsubmission). With sec the flattened SEC
+    blocks of the frames (flatten_SEC) are returned too, for genSEC."""
+    if chunksize:
+        chunks = streamsubmission(filename, chunksize, version)
+    else:
+        getvalidator(version)  # reports a missing schema before reading the submission
+        try:
+            with open(filename) as f:
+                d = json.load(f)
+        except:
+            sys.exit("CAN NOT OPEN JSON SUBMISSION FILE: " + filename)
 
-    try:
-        jsonschema.validate(d, schema)
-    except Exception as e:
-        print(e)
-        sys.exit("ERROR: System submission json failed validation:\n" + str(e) + "\n")
+        try:
+            validatesubmission(d, version)
+        except Exception as e:
+            print(e)
+            sys.exit("ERROR: System submission json failed validation:\n" + str(e) + "\n")
+        chunks = [json_normalize(d)]
 
+    # the normalized frames are concatenated once, after the (empty) table of the expected columns
     mysubmission = pd.DataFrame(
         columns=[
             "Confidence",
@@ -339,7 +578,11 @@ def getsubmission(filename, gravity, filelist, threshold=0.0, nonils=False):
             "SEC",
         ]
     )
-    mysubmission = mysubmission.append(json_normalize(d), sort=True)
+    mysubmission = pd.concat([mysubmission] + chunks, sort=True)
+
+    # the SEC blocks are flattened once, the frames keep whether any of their blocks has fear or anger
+    blocks = flatten_SEC(mysubmission["SEC"])
+    mysubmission["fear"], mysubmission["anger"] = blockemotionflags(blocks, mysubmission.index)
 
     d = {True: True, False: False, np.nan: False}
     mysubmission["urgent"] = mysubmission["Urgent"].map(d)
@@ -356,7 +599,6 @@ def getsubmission(filename, gravity, filelist, threshold=0.0, nonils=False):
         lambda x: "issue" if x in issue_types else "need"
     )
 
-    mysubmission["gravity"] = mysubmission.apply(gravity, axis=1)
     mysubmission["frame_count"] = 1
     mysubmission["DocumentID"] = mysubmission["DocumentID"].str.rstrip(".txt")
 
@@ -367,15 +609,46 @@ def getsubmission(filename, gravity, filelist, threshold=0.0, nonils=False):
         except:
             sys.exit("FAILED TO OPEN REFERENCE LIST FILE: " + filelist)
         mysubmission = mysubmission[mysubmission["DocumentID"].isin(myfiles[0])]
-        if threshold:
-            print("Threshold present. Discarting frames below: ", str(threshold))
-            mysubmission = mysubmission[mysubmission["Confidence"] > threshold]
     if nonils:
         print("Removing NILs from submission.")
         mysubmission = mysubmission[~mysubmission.Place_KB_ID.str.contains('nil', case=False)]            
+    if sec:
+        return mysubmission, blocks[blocks["frame"].isin(mysubmission.index).values]
     return mysubmission
 
 
+def thresholdsubmission(mysubmission, filelist, threshold):
+    if filelist and threshold and (mysubmission.shape[0] > 0):
+        print("Threshold present. Discarting frames below: ", str(threshold))
+        mysubmission = mysubmission[mysubmission["Confidence"] > threshold]
+    return mysubmission
+
+
+def getsubmission(filename, gravity, filelist, threshold=0.0, nonils=False, chunksize=None):
+    mysubmission = getsubmissionBase(filename, filelist, nonils=nonils, chunksize=chunksize)
+    return withgravity(thresholdsubmission(mysubmission, filelist, threshold), gravity)
+
+
+def stacksubmissions(tables, systems):
+    """The submission tables of several systems as one table, with the system of every frame
+    in the system_id column. The *_systems metric functions score all of them at once."""
+    return pd.concat(
+        [table.assign(system_id=system) for table, system in zip(tables, systems)],
+        ignore_index=True,
+        sort=False,
+    )
+
+
+def submission_systems(systemTable, systems=None):
+    """The systems of a stacked submission table, in order of appearance unless given."""
+    return list(pd.unique(systemTable["system_id"].values)) if systems is None else list(systems)
+
+
+def system_codes(table, systems):
+    """Position in systems of the system of every row of table."""
+    return pd.Categorical(table["system_id"].values, categories=systems).codes.astype(int)
+
+
 def dcg_at_k(r, k, method=0):
     r = np.asfarray(r)[:k]
     if r.size:
@@ -402,6 +675,33 @@ def ndcg_at_k(r, k, method=0):
     return dcg_at_k(r["sysgain"], k, method) / dcg_max
 
 
+def dcg_discounts(n, method=0):
+    """Denominators applied to the gains at ranks 1..n by dcg_at_k."""
+    if method == 0:
+        return np.concatenate(([1.0], np.log2(np.arange(2, n + 1))))[:n]
+    elif method == 1:
+        return np.log2(np.arange(2, n + 2))
+    else:
+        raise ValueError("method must be 0 or 1.")
+
+
+def dcg_curve(r, method=0):
+    """dcg_at_k(r, k, method) for every k in 1..len(r), as a single cumulative sum. np.cumsum
+    adds the discounted gains in rank order while dcg_at_k sums them pairwise, so the values
+    may differ from dcg_at_k in the last digits."""
+    r = np.asfarray(r)
+    return np.cumsum(r / dcg_discounts(r.size, method))
+
+
+def ndcg_curve(r, method=0):
+    """ndcg_at_k(r, k, method) for every k in 1..len(r)."""
+    dcg_max = dcg_curve(np.sort(np.asfarray(r["gain"]))[::-1], method)
+    dcg = dcg_curve(r["sysgain"], method)
+    ndcg = np.zeros(dcg.size)
+    np.divide(dcg, dcg_max, out=ndcg, where=dcg_max != 0)
+    return ndcg.tolist()
+
+
 def gain(row):
     if row["gravity"] >= int(config["GraveFrameCounts"]["HighGravity"]):
         return int(config["Gain"]["High"])
@@ -425,9 +725,7 @@ def boolean_gravity(row):
 def numeric_gravity(row):
     frame_type = row["frame_type"]
     try:
-        sentiments = row["emotion_value"] if not pd.isna(row["emotion_value"]) else []
-        sentiments = [s for s in sentiments if type(s)==str]
-        sentiments_str = ','.join(sentiments)
+        sentiments_str = joinsentiments(row["emotion_value"])
     except KeyError:
         sentiments = []
         for block in row["SEC"]:
@@ -461,8 +759,69 @@ def numeric_gravity(row):
     return gravity
 
 
+def truthy(column):
+    """Truth value of every element of a column, as the row functions test it."""
+    return column.values.astype(bool)
+
+
+def boolean_gravity_column(table):
+    """boolean_gravity of every row of table."""
+    return truthy(table["current"]) & truthy(table["unresolved"]) & truthy(table["urgent"])
+
+
+def joinsentiments(emotion_value):
+    """Comma joined emotion values of a frame, given joined already or as a sequence."""
+    if isinstance(emotion_value, str):
+        return emotion_value
+    sentiments = emotion_value if not pd.isna(emotion_value) else []
+    return ",".join([s for s in sentiments if type(s) == str])
+
+
+def blockemotionflags(blocks, frames):
+    """Whether any of the flattened SEC blocks (flatten_SEC) of every frame of the index
+    frames has the Emotion_Fear flag, and whether any has the Emotion_Anger flag."""
+    frame = frames.get_indexer(blocks["frame"].values)
+    fear = np.bincount(frame[blocks["Emotion_Fear"].values == 1], minlength=len(frames)) > 0
+    anger = np.bincount(frame[blocks["Emotion_Anger"].values == 1], minlength=len(frames)) > 0
+    return fear, anger
+
+
+def emotionflags(table):
+    """Whether the sentiments of every frame mention fear and anger: the emotion values of
+    reference frames, or the Emotion_Fear/Emotion_Anger flags of the submission SEC blocks
+    (kept by getsubmissionBase as the fear and anger columns)."""
+    if "emotion_value" in table.columns:
+        sentiments = pd.Series([joinsentiments(v) for v in table["emotion_value"].values], dtype=object)
+        fear = sentiments.str.contains("fear", regex=False).values
+        anger = sentiments.str.contains("anger", regex=False).values
+        return fear.astype(bool), anger.astype(bool)
+
+    if "fear" in table.columns and "anger" in table.columns:
+        return truthy(table["fear"]), truthy(table["anger"])
+
+    sec = table["SEC"].reset_index(drop=True)
+    return blockemotionflags(flatten_SEC(sec), sec.index)
 
 
+def numeric_gravity_column(table):
+    """numeric_gravity of every row of table."""
+    fear, anger = emotionflags(table)
+    current, unresolved, urgent = truthy(table["current"]), truthy(table["unresolved"]), truthy(table["urgent"])
+    frame_type = table["frame_type"].values
+    need = (frame_type == "need") & current & unresolved & urgent
+    issue = (frame_type == "issue") & current & urgent & (fear | anger)
+
+    gravity = np.zeros(table.shape[0])
+    gravity[need] += 1
+    gravity[need & fear] += 0.2
+    gravity[need & anger] += 0.2
+    gravity[issue] += 1
+    gravity[issue & fear & anger] += 0.2
+    return gravity
+
+
+# column-wise equivalents of the row gravity functions; withgravity uses them in their place
+GRAVITY_COLUMNS = {boolean_gravity: boolean_gravity_column, numeric_gravity: numeric_gravity_column}
 
 
 def genTrue_TypePlace(row):  # type place
@@ -528,66 +887,215 @@ def genTrue_TypePlaceStatusUrgencyResolution(row):  # type place status urgency
         return 0
 
 
-# MAP
-def mapmar(reference, system, genTrue):
-    # np.seterr(all='raise')
-    avgPrecision = []
-    recall = []
-
-    grouped = reference.groupby(["type", "kb_id"])
+# Comparisons between a submission frame (_x) and a reference frame (_y) of the same
+# document and type, and the equivalence classes built from them
+FRAME_COMPARISONS = {
+    "place": ("Place_KB_ID", "kb_id"),
+    "status": ("Status", "status"),
+    "current": ("current_x", "current_y"),
+    "urgent": ("urgent_x", "urgent_y"),
+    "unresolved": ("unresolved_x", "unresolved_y"),
+}
+
+EQCLASSES = {
+    "Type": [],
+    "TypePlace": ["place"],
+    "TypePlaceStatus": ["place", "status"],
+    "TypePlaceStatusUrgency": ["place", "status", "urgent"],
+    "TypePlaceStatusResolution": ["place", "status", "unresolved"],
+    "TypePlaceStatusUrgencyResolution": ["place", "status", "urgent", "unresolved"],
+    "TypePlaceCurrent": ["place", "current"],
+    "TypePlaceCurrentUrgency": ["place", "current", "urgent"],
+    "TypePlaceCurrentResolution": ["place", "current", "unresolved"],
+    "TypePlaceCurrentUrgencyResolution": ["place", "current", "urgent", "unresolved"],
+}
+
+# MAP/MAR equivalence class of each genTrue_* row predicate
+GENTRUE_EQCLASS = {
+    genTrue_TypePlace: "TypePlace",
+    genTrue_TypePlaceStatus: "TypePlaceCurrent",
+    genTrue_TypePlaceStatusUrgency: "TypePlaceCurrentUrgency",
+    genTrue_TypePlaceStatusResolution: "TypePlaceCurrentResolution",
+    genTrue_TypePlaceStatusUrgencyResolution: "TypePlaceCurrentUrgencyResolution",
+}
+
+
+def frame_alignment(systemTable, referenceTable):
+    """Joins every submission frame with the reference frames of the same document and
+    type, once, and flags each pair with a boolean column per equivalence class.
+    Returns a dict with the "system" and "reference" tables (with sys_pos and ref_pos
+    position columns) and the "pairs" table."""
+    system = systemTable.assign(sys_pos=np.arange(systemTable.shape[0]))
+    reference = referenceTable.assign(ref_pos=np.arange(referenceTable.shape[0]))
+    pairs = pd.merge(
+        system,
+        reference,
+        how="inner",
+        left_on=["DocumentID", "Type"],
+        right_on=["doc_id", "type"],
+    )
+    comparisons = {}
+    for name, (sys_column, ref_column) in FRAME_COMPARISONS.items():
+        if sys_column in pairs.columns and ref_column in pairs.columns:
+            comparisons[name] = (pairs[sys_column] == pairs[ref_column]).values
+        else:
+            comparisons[name] = np.zeros(pairs.shape[0], dtype=bool)
+    for eqclass, names in EQCLASSES.items():
+        match = np.ones(pairs.shape[0], dtype=bool)
+        for name in names:
+            match &= comparisons[name]
+        pairs[eqclass] = match
+    return {"system": system, "reference": reference, "pairs": pairs}
+
+
+def subset_alignment(alignment, system_mask, reference_mask):
+    """Restricts an alignment to the selected submission and reference frames."""
+    system = alignment["system"][np.asarray(system_mask, dtype=bool)]
+    reference = alignment["reference"][np.asarray(reference_mask, dtype=bool)]
+    pairs = alignment["pairs"]
+    pairs = pairs[pairs["sys_pos"].isin(system["sys_pos"]) & pairs["ref_pos"].isin(reference["ref_pos"])]
+    return {"system": system, "reference": reference, "pairs": pairs}
+
+
+def segmented_average_precision(groups, scores, labels, ngroups):
+    """Average precision (as sklearn's average_precision_score) of every group at once.
+    Groups without rows or without a single true label get an AP of 0."""
+    groups = np.asarray(groups, dtype=int)
+    scores = np.asarray(scores, dtype=float)
+    labels = np.asarray(labels, dtype=float)
+    ap = np.zeros(ngroups)
+    if groups.size == 0:
+        return ap
+
+    order = np.lexsort((-scores, groups))
+    groups, scores, labels = groups[order], scores[order], labels[order]
+
+    group_start = np.r_[True, groups[1:] != groups[:-1]]
+    block_end = np.r_[(groups[1:] != groups[:-1]) | (scores[1:] != scores[:-1]), True]
+    # cumulative counts restarting at every group
+    start_pos = np.maximum.accumulate(np.where(group_start, np.arange(groups.size), 0))
+    tps = np.cumsum(labels)
+    tps = tps - (tps[start_pos] - labels[start_pos])
+    count = np.arange(groups.size) - start_pos + 1
+
+    end_groups = groups[block_end]
+    end_tps = tps[block_end]
+    first_block = np.r_[True, end_groups[1:] != end_groups[:-1]]
+    delta_tps = np.where(first_block, end_tps, end_tps - np.r_[0.0, end_tps[:-1]])
+    total = np.bincount(groups, weights=labels, minlength=ngroups)
+
+    weighted = np.bincount(
+        end_groups, weights=delta_tps * end_tps / count[block_end], minlength=ngroups
+    )
+    np.divide(weighted, total, out=ap, where=total > 0)
+    return ap
 
-    for mygroup, KBsituation in grouped:
 
-        sysKBsituation = system[
-            (system["Place_KB_ID"] == str(mygroup[1])) & (system["Type"] == str(mygroup[0]))
-        ]
-        # keep only highest confidence frame for each input file
-        sysKBsituation = sysKBsituation.drop_duplicates(
-            subset=["DocumentID", "Place_KB_ID"], keep="first"
-        )
+# MAP
+def mapmar(reference, system, genTrue, alignment=None):
+    if alignment is None:
+        alignment = frame_alignment(system, reference)
+    system, reference, pairs = alignment["system"], alignment["reference"], alignment["pairs"]
+
+    reference = reference[reference["type"].notnull() & reference["kb_id"].notnull()]
+    group = reference.groupby(["type", "kb_id"]).ngroup()
+    ngroups = int(group.max()) + 1 if reference.shape[0] > 0 else 0
+    ref_group = pd.Series(group.values, index=reference["ref_pos"].values)
+
+    # keep only the first frame for each input file of a KB-level situation
+    sysKBsituation = system[
+        ~system.duplicated(subset=["DocumentID", "Type", "Place_KB_ID"], keep="first")
+    ]
+    sysKBsituation = pd.merge(
+        sysKBsituation[["sys_pos", "Type", "Place_KB_ID", "Confidence"]],
+        reference[["type", "kb_id"]].assign(group=group.values).drop_duplicates(),
+        how="inner",
+        left_on=["Type", "Place_KB_ID"],
+        right_on=["type", "kb_id"],
+    )
 
-        KBmergedAP = pd.merge(
-            sysKBsituation, KBsituation, how="left", left_on=["DocumentID"], right_on=["doc_id"]
-        )
-        KBmergedAP = KBmergedAP.sort_values(by="Confidence", ascending=False, na_position="last")
-
-        if not KBmergedAP.empty:
-            # print("table not empty")
-            KBmergedAP["true"] = KBmergedAP.apply(genTrue, axis=1)
-            # print("AP true conf pairs:\n",(KBmergedAP.true, KBmergedAP.Confidence))
-            if not (max(KBmergedAP.true) == 0):
-                try:
-                    myprecision = average_precision_score(KBmergedAP.true, KBmergedAP.Confidence)
-                    # print("succeeded, adding to list")
-                    avgPrecision.append(myprecision)
-                    # print("avgprecision: ", myprecision)
-                except FloatingPointError:
-                    # print("caught exception, adding zero")
-                    avgPrecision.append(0.0)
-            else:
-                # print("table empty AP 0")
-                avgPrecision.append(0.0)
-        else:
-            # print("table empty AP 0")
-            avgPrecision.append(0.0)
+    KBpairs = pairs[pairs["TypePlace"] & pairs["sys_pos"].isin(sysKBsituation["sys_pos"])]
+    if genTrue in GENTRUE_EQCLASS:
+        true = KBpairs[GENTRUE_EQCLASS[genTrue]].values.astype(int)
+    else:
+        true = KBpairs.apply(genTrue, axis=1).values if KBpairs.shape[0] else np.zeros(0)
+    KBgroups = ref_group[KBpairs["ref_pos"].values].values
+
+    # submission frames without a reference frame in their document are false positives
+    unmatched = sysKBsituation[~sysKBsituation["sys_pos"].isin(KBpairs["sys_pos"])]
+    avgPrecision = segmented_average_precision(
+        np.r_[KBgroups, unmatched["group"].values],
+        np.r_[KBpairs["Confidence"].values, unmatched["Confidence"].values],
+        np.r_[true, np.zeros(unmatched.shape[0])],
+        ngroups,
+    )
 
-        KBmergedAR = pd.merge(
-            sysKBsituation, KBsituation, how="right", left_on=["DocumentID"], right_on=["doc_id"]
-        )
-        KBmergedAR = KBmergedAR.sort_values(by="Confidence", ascending=False, na_position="last")
-        KBmergedAR["true"] = 1
-        KBmergedAR["returned"] = KBmergedAR.apply(genTrue, axis=1)
-        KBmergedAR.Confidence.fillna(-1, inplace=True)
-        # print(mygroup)
-        myrecall = recall_score(KBmergedAR.true, KBmergedAR.returned)
-        # print(myrecall)
-        recall.append(myrecall)
+    returned = np.bincount(
+        KBgroups.astype(int), weights=np.asarray(true, dtype=float), minlength=ngroups
+    )
+    recall = returned / np.bincount(group.values, minlength=ngroups)
 
     meanAP = np.mean(avgPrecision)
     macroAR = np.mean(recall)
     return meanAP, macroAR
 
 
+def mapmar_systems(reference, system, genTrue, systems=None, alignment=None):
+    """mapmar of every system of a stacked submission table at once, as the arrays of the MAP
+    and MAR of the systems. The KB-level situations of every system are separate groups."""
+    systems = submission_systems(system, systems)
+    if alignment is None:
+        alignment = frame_alignment(system, reference)
+    system, reference, pairs = alignment["system"], alignment["reference"], alignment["pairs"]
+    nsystems = len(systems)
+
+    reference = reference[reference["type"].notnull() & reference["kb_id"].notnull()]
+    group = reference.groupby(["type", "kb_id"]).ngroup()
+    ngroups = int(group.max()) + 1 if reference.shape[0] > 0 else 0
+    ref_group = pd.Series(group.values, index=reference["ref_pos"].values)
+    sys_code = pd.Series(system_codes(system, systems), index=system["sys_pos"].values)
+
+    # keep only the first frame for each input file of a KB-level situation of a system
+    sysKBsituation = system[
+        ~system.duplicated(subset=["system_id", "DocumentID", "Type", "Place_KB_ID"], keep="first")
+    ]
+    sysKBsituation = pd.merge(
+        sysKBsituation[["sys_pos", "Type", "Place_KB_ID", "Confidence"]],
+        reference[["type", "kb_id"]].assign(group=group.values).drop_duplicates(),
+        how="inner",
+        left_on=["Type", "Place_KB_ID"],
+        right_on=["type", "kb_id"],
+    )
+
+    KBpairs = pairs[pairs["TypePlace"] & pairs["sys_pos"].isin(sysKBsituation["sys_pos"])]
+    if genTrue in GENTRUE_EQCLASS:
+        true = KBpairs[GENTRUE_EQCLASS[genTrue]].values.astype(int)
+    else:
+        true = KBpairs.apply(genTrue, axis=1).values if KBpairs.shape[0] else np.zeros(0)
+    KBgroups = (
+        sys_code[KBpairs["sys_pos"].values].values * ngroups
+        + ref_group[KBpairs["ref_pos"].values].values
+    )
+
+    # submission frames without a reference frame in their document are false positives
+    unmatched = sysKBsituation[~sysKBsituation["sys_pos"].isin(KBpairs["sys_pos"])]
+    avgPrecision = segmented_average_precision(
+        np.r_[KBgroups, sys_code[unmatched["sys_pos"].values].values * ngroups + unmatched["group"].values],
+        np.r_[KBpairs["Confidence"].values, unmatched["Confidence"].values],
+        np.r_[true, np.zeros(unmatched.shape[0])],
+        nsystems * ngroups,
+    )
+
+    returned = np.bincount(
+        KBgroups.astype(int), weights=np.asarray(true, dtype=float), minlength=nsystems * ngroups
+    )
+    recall = returned / np.tile(np.bincount(group.values, minlength=ngroups), nsystems)
+
+    meanAP = avgPrecision.reshape(nsystems, ngroups).mean(axis=1)
+    macroAR = recall.reshape(nsystems, ngroups).mean(axis=1)
+    return meanAP, macroAR
+
+
 def genNDCGplot(filename, sysname, k, myndcg):
     plt.scatter(k, myndcg, marker=".", s=10, linewidth=0.5, color="red")
     # plt.plot(k, myndcg, linestyle='-', color = "blue")
@@ -637,17 +1145,27 @@ def genSEC(
     pairs_to_match_frames,
     edl_ref=None,
     edl_subm=None,
+    sentiments=None,
+    edl_submission_docs=False,
+    cachedir=None,
+    nil_match="exact",
+    blocks=None,
+    edl_ref_index=None,
 ):
 
-    mapping = nil_mapper(edl_subm, edl_ref) if edl_ref and edl_subm else None
-
-    sec_ref = get_SEC_ref(path_for_sentiments)
-    scores = [
-        SEC_scoring(referenceTable, sec_ref, systemTable, ref_el=i, sub_el=j, mapping=mapping)
-        for i, j, n in pairs_to_match_frames
-    ]
+    # with edl_submission_docs only the EDL mentions of the documents of the system output are read
+    docs = systemTable["DocumentID"].unique() if edl_submission_docs else None
+    mapping = (
+        nil_mapper(edl_subm, edl_ref, docs=docs, cachedir=cachedir, policy=nil_match, index=edl_ref_index)
+        if edl_ref and edl_subm
+        else None
+    )
 
-    return scores
+    # the sentiments already read with the reference (referenceBase["sentiments"]) if given
+    sec_ref = sentiments if sentiments is not None else getSentiments(path_for_sentiments)
+    # the sentiment tables are prepared once for all the equivalence classes
+    # blocks: the SEC blocks flattened when the submission was read (getsubmissionBase with sec)
+    return SEC_scores(referenceTable, sec_ref, systemTable, mapping, pairs_to_match_frames, blocks)
 
 
 def genSEC_results(
@@ -682,10 +1200,15 @@ def genSEC_results(
             ofile.write("\t".join([b[2]] + [str(e) for e in a]) + "\n")
 
 
-def genNDCG(referenceNDCG, systemTable, breakties=None, method=0):
+NDCG_BREAKTIES = ["standard", "vindictive", "forgiving"]
+
+
+def ndcg_situations(referenceNDCG, systemTable):
+    """Outer-merges the reference KB-level situations with the system's, shared by all
+    nDCG tie-breaking modes and discount methods."""
     mysystem = (
         systemTable.groupby(["Place_KB_ID", "Type"])[
-            "urgent", "unresolved", "current", "gravity", "frame_count"
+            ["urgent", "unresolved", "current", "gravity", "frame_count"]
         ]
         .agg(["sum"])
         .reset_index()
@@ -704,46 +1227,52 @@ def genNDCG(referenceNDCG, systemTable, breakties=None, method=0):
     merged.gravity = merged.gravity.fillna(0)
     merged.gain = merged.gain.fillna(0)
     merged.frame_count = merged.frame_count.fillna(0)
-    merged["sysgain"] = merged.apply(
-        lambda x: int(x["gain"]) if x["frame_count"] > 0 else 0, axis=1
+    merged["sysgain"] = np.where(
+        merged["frame_count"].values > 0, merged["gain"].values.astype(int), 0
     )
+    return merged.reset_index(drop=True)
+
+
+def ndcg_order(merged, breakties):
+    """Positions of the merged situations in ranked order for a tie-breaking mode."""
     if breakties == "forgiving":
-        merged = merged.sort_values(by=["gravity", "sysgain"], ascending=False)
+        return np.lexsort(
+            (-merged["sysgain"].values, -merged["gravity"].values.astype(float))
+        )
     elif breakties == "vindictive":
-        merged = merged.sort_values(by=["gravity", "sysgain"], ascending=[False, True])
+        return np.lexsort(
+            (merged["sysgain"].values, -merged["gravity"].values.astype(float))
+        )
     elif breakties == "standard":
-        merged = merged.sort_values(by=["gravity"], ascending=False)
+        return merged[["gravity"]].sort_values(by=["gravity"], ascending=False).index.values
     else:
-        sys.exit("Error: Unrecognized nDCG tie breaking method: " + breakties)
-    k = range(1, len(merged["gain"]) + 1)
-    return [ndcg_at_k(merged, i, method) for i in k], k
+        sys.exit("Error: Unrecognized nDCG tie breaking method: " + str(breakties))
 
 
-def correctkbids(systemTable, referenceTable):
-    def kbidcorrector(row):
-        currentfile = referenceTable[
-            (referenceTable["doc_id"] == row["DocumentID"])
-            & (referenceTable["type"] == row["Type"])
-            & (referenceTable.kb_id.str.contains("\|") == True)
-        ]
-        if len(currentfile.index) > 0:
-            for _, refrow in currentfile.iterrows():
-                if row["Place_KB_ID"] in refrow["kb_id"].split("|"):
-                    return currentfile["kb_id"].unique()[0]
-        return row["Place_KB_ID"]
+def genNDCG_variants(referenceNDCG, systemTable, breakties=NDCG_BREAKTIES, methods=(0,)):
+    """nDCG@k curves for every (breakties, method) pair from a single situation merge."""
+    merged = ndcg_situations(referenceNDCG, systemTable)
+    curves = {}
+    for mode in breakties:
+        ranked = merged.iloc[ndcg_order(merged, mode)]
+        for method in methods:
+            curves[(mode, method)] = ndcg_curve(ranked, method)
+    k = range(1, len(merged["gain"]) + 1)
+    return curves, k
 
-    if systemTable.shape[0] > 0:
-        systemTable["Place_KB_ID"] = systemTable.apply(kbidcorrector, axis=1)
-    return systemTable
 
+def genNDCG(referenceNDCG, systemTable, breakties=None, method=0):
+    curves, k = genNDCG_variants(referenceNDCG, systemTable, [breakties], [method])
+    return curves[(breakties, method)], k
 
-# precision at N
-def precisionN(referenceNDCG, systemTable):
-    referenceNDCG.rename(columns={"gain": "refGain"}, inplace=True)
 
+def ndcg_situations_systems(referenceNDCG, systemTable, systems):
+    """ndcg_situations of every system of a stacked submission table from one outer merge,
+    ordered by system (the position in systems, in the system column)."""
     mysystem = (
-        systemTable.groupby(["Place_KB_ID", "Type"])[
-            "urgent", "unresolved", "current", "gravity", "frame_count"
+        systemTable.assign(system=system_codes(systemTable, systems))
+        .groupby(["system", "Place_KB_ID", "Type"])[
+            ["urgent", "unresolved", "current", "gravity", "frame_count"]
         ]
         .agg(["sum"])
         .reset_index()
@@ -751,74 +1280,305 @@ def precisionN(referenceNDCG, systemTable):
     mysystem.columns = mysystem.columns.droplevel(1)
     if mysystem.shape[0] > 0:
         mysystem = mysystem[mysystem["Place_KB_ID"] != ""]
-
+    reference = referenceNDCG[["kb_id", "type", "gain"]]
+    reference = pd.DataFrame(
+        {
+            "kb_id": np.tile(reference["kb_id"].values, len(systems)),
+            "type": np.tile(reference["type"].values, len(systems)),
+            "gain": np.tile(reference["gain"].values, len(systems)),
+            "system": np.repeat(np.arange(len(systems)), reference.shape[0]),
+        }
+    )
     merged = pd.merge(
-        referenceNDCG[["kb_id", "type", "refGain"]],
+        reference,
         mysystem,
         how="outer",
-        left_on=["kb_id", "type"],
-        right_on=["Place_KB_ID", "Type"],
+        left_on=["system", "kb_id", "type"],
+        right_on=["system", "Place_KB_ID", "Type"],
+    )
+    # the rows of every system in the order of its own outer merge
+    merged = merged.iloc[np.argsort(merged["system"].values, kind="mergesort")]
+
+    merged.gravity = merged.gravity.fillna(0)
+    merged.gain = merged.gain.fillna(0)
+    merged.frame_count = merged.frame_count.fillna(0)
+    merged["sysgain"] = np.where(
+        merged["frame_count"].values > 0, merged["gain"].values.astype(int), 0
     )
-    merged.refGain = merged.refGain.fillna(0)
-    merged["score"] = merged.apply(lambda x: 1 if x["frame_count"] > 0 else 0, axis=1)
-    merged = merged[merged.refGain == int(config["Gain"]["High"])]
+    return merged.reset_index(drop=True)
+
+
+def system_ranks(system, nsystems):
+    """Start of the rows of every system in the system ordered array system, and the rank
+    (from 1) of every row within its system."""
+    bounds = np.searchsorted(system, np.arange(nsystems + 1))
+    return bounds, np.arange(system.size) - bounds[system] + 1
+
+
+def genNDCG_systems(referenceNDCG, systemTable, systems=None, breakties=NDCG_BREAKTIES, methods=(0,)):
+    """genNDCG_variants of every system of a stacked submission table (see stacksubmissions),
+    as a table of the nDCG at every k for every system_id, breakties and method."""
+    systems = submission_systems(systemTable, systems)
+    merged = ndcg_situations_systems(referenceNDCG, systemTable, systems)
+    system = merged["system"].values
+    bounds, k = system_ranks(system, len(systems))
+    situations = [merged.iloc[start:end].reset_index(drop=True) for start, end in zip(bounds[:-1], bounds[1:])]
+
+    results = []
+    for mode in breakties:
+        # the tie-breaking order of every system is the one of its own situations, and its
+        # curve is summed as genNDCG_variants sums it
+        ranked = [mysituations.iloc[ndcg_order(mysituations, mode)] for mysituations in situations]
+        for method in methods:
+            ndcg = np.concatenate([np.zeros(0)] + [ndcg_curve(myranked, method) for myranked in ranked])
+            results.append(
+                pd.DataFrame(
+                    {
+                        "system_id": np.asarray(systems, dtype=object)[system],
+                        "breakties": mode,
+                        "method": method,
+                        "k": k,
+                        "nDCG": ndcg,
+                    },
+                    columns=["system_id", "breakties", "method", "k", "nDCG"],
+                )
+            )
+    if not results:
+        return pd.DataFrame(columns=["system_id", "breakties", "method", "k", "nDCG"])
+    return pd.concat(results, ignore_index=True)
+
+
+def kbid_alias_index(referenceTable):
+    """Maps each component of a compound reference kb_id ("a|b|c") to the
+    canonical compound id of its (doc_id, type), i.e. the first compound id
+    listed in the reference for that document and type."""
+    compound = referenceTable.loc[
+        referenceTable["kb_id"].str.contains("|", regex=False) == True, ["doc_id", "type", "kb_id"]
+    ]
+    canonical = compound.drop_duplicates(subset=["doc_id", "type"], keep="first")
+    components = compound["kb_id"].str.split("|")
+    lengths = components.str.len().values
+    alias = pd.DataFrame(
+        {
+            "DocumentID": np.repeat(compound["doc_id"].values, lengths),
+            "Type": np.repeat(compound["type"].values, lengths),
+            "Place_KB_ID": np.concatenate(components.tolist())
+            if len(compound)
+            else np.array([], dtype=object),
+        },
+        columns=["DocumentID", "Type", "Place_KB_ID"],
+    )
+    alias = alias.drop_duplicates()
+    alias = pd.merge(
+        alias,
+        canonical.rename(
+            columns={"doc_id": "DocumentID", "type": "Type", "kb_id": "canonical_kb_id"}
+        ),
+        how="inner",
+        on=["DocumentID", "Type"],
+    )
+    return alias
+
+
+def correctkbids(systemTable, referenceTable, alias_index=None):
+    if alias_index is None:
+        alias_index = kbid_alias_index(referenceTable)
 
-    mylist = []
-    for my_n in range(1, merged.shape[0] + 1):
-        my_n_merged = merged.head(my_n)
-        mylist.append(
-            (my_n, my_n_merged[my_n_merged.score == True].shape[0] / my_n_merged.shape[0])
+    if systemTable.shape[0] > 0:
+        merged = pd.merge(
+            systemTable[["DocumentID", "Type", "Place_KB_ID"]],
+            alias_index,
+            how="left",
+            on=["DocumentID", "Type", "Place_KB_ID"],
+        )
+        systemTable["Place_KB_ID"] = np.where(
+            merged["canonical_kb_id"].isnull().values,
+            systemTable["Place_KB_ID"].values,
+            merged["canonical_kb_id"].values,
         )
-    return mylist
+    return systemTable
 
 
-def genMAPMAR_results(filename, systemName, referenceTable, systemTable):
-    with open(filename, "w") as mapmar_results_file:
+# precision at N
+def precisionN(referenceNDCG, systemTable, cutoffs=None):
+    """Precision at N over the high gain situations, for every N or only the given cutoffs."""
+    merged = ndcg_situations(referenceNDCG, systemTable)
+    merged = merged[merged["gain"] == int(config["Gain"]["High"])]
+
+    hits = np.cumsum(merged["frame_count"].values > 0)
+    my_n = np.arange(1, hits.size + 1)
+    precision = hits / my_n
+    if cutoffs is not None:
+        keep = np.in1d(my_n, cutoffs)
+        my_n, precision = my_n[keep], precision[keep]
+    return list(zip(my_n.tolist(), precision.tolist()))
+
+
+def precisionN_systems(referenceNDCG, systemTable, systems=None, cutoffs=None):
+    """precisionN of every system of a stacked submission table, as a table of the precision
+    at every N (or only the given cutoffs) for every system_id."""
+    systems = submission_systems(systemTable, systems)
+    merged = ndcg_situations_systems(referenceNDCG, systemTable, systems)
+    merged = merged[merged["gain"] == int(config["Gain"]["High"])]
+
+    system = merged["system"].values
+    hits = pd.Series((merged["frame_count"].values > 0).astype(int)).groupby(system).cumsum().values
+    my_n = system_ranks(system, len(systems))[1]
+    precision = hits / my_n
+    keep = np.in1d(my_n, cutoffs) if cutoffs is not None else np.ones(my_n.size, dtype=bool)
+    return pd.DataFrame(
+        {
+            "system_id": np.asarray(systems, dtype=object)[system[keep]],
+            "N": my_n[keep],
+            "precision": precision[keep],
+        },
+        columns=["system_id", "N", "precision"],
+    )
 
-        mapmar_results_file.write("SF Diagnostic Scores for Sysyem: " + systemName + "\n")
 
-        mymap, mymar = mapmar(referenceTable, systemTable, genTrue_TypePlace)
-        mapmar_results_file.write("EqClass_Type+Place_MAP: " + str(mymap) + "\n")
-        mapmar_results_file.write("EqClass_Type+Place_MAR: " + str(mymar) + "\n")
+# MAP/MAR equivalence classes reported by genMAPMAR_results, by their genTrue_* row predicate
+MAPMAR_EQCLASSES = [
+    (genTrue_TypePlace, "EqClass_Type+Place"),
+    (genTrue_TypePlaceStatus, "EqClass_Type+Place+Status"),
+    (genTrue_TypePlaceStatusUrgency, "EqClass_Type+Place+Status+Urgency"),
+    (genTrue_TypePlaceStatusResolution, "EqClass_Type+Place+Status+Resolution"),
+    (genTrue_TypePlaceStatusUrgencyResolution, "EqClass_Type+Place+Status+Urgency+Resolution"),
+]
 
-        mymap, mymar = mapmar(referenceTable, systemTable, genTrue_TypePlaceStatus)
-        mapmar_results_file.write("EqClass_Type+Place+Status_MAP: " + str(mymap) + "\n")
-        mapmar_results_file.write("EqClass_Type+Place+Status_MAR: " + str(mymar) + "\n")
 
-        mymap, mymar = mapmar(referenceTable, systemTable, genTrue_TypePlaceStatusUrgency)
-        mapmar_results_file.write("EqClass_Type+Place+Status+Urgency_MAP: " + str(mymap) + "\n")
-        mapmar_results_file.write("EqClass_Type+Place+Status+Urgency_MAR: " + str(mymar) + "\n")
+def grave_frames(table):
+    """Whether every frame of a reference or submission table is urgent and unresolved."""
+    return (table.urgent == True) & (table.unresolved == True)
 
-        mymap, mymar = mapmar(referenceTable, systemTable, genTrue_TypePlaceStatusResolution)
-        mapmar_results_file.write("EqClass_Type+Place+Status+Resolution_MAP: " + str(mymap) + "\n")
-        mapmar_results_file.write("EqClass_Type+Place+Status+Resolution_MAR: " + str(mymar) + "\n")
 
-        mymap, mymar = mapmar(referenceTable, systemTable, genTrue_TypePlaceStatusUrgencyResolution)
-        mapmar_results_file.write(
-            "EqClass_Type+Place+Status+Urgency+Resolution_MAP: " + str(mymap) + "\n"
-        )
-        mapmar_results_file.write(
-            "EqClass_Type+Place+Status+Urgency+Resolution_MAR: " + str(mymar) + "\n"
-        )
+def writeMAPMAR_results(filename, systemName, scores):
+    """Writes the (name, value) MAP and MAR scores of a system."""
+    with open(filename, "w") as mapmar_results_file:
+        mapmar_results_file.write("SF Diagnostic Scores for Sysyem: " + systemName + "\n")
+        for name, value in scores:
+            mapmar_results_file.write(name + ": " + str(value) + "\n")
+    return
 
-        referenceGraveTable = referenceTable[
-            (referenceTable.urgent == True) & (referenceTable.unresolved == True)
-        ]
-        systemGraveTable = systemTable[
-            (systemTable.urgent == True) & (systemTable.unresolved == True)
-        ]
-        mymap, mymar = mapmar(
-            referenceGraveTable, systemGraveTable, genTrue_TypePlaceStatusUrgencyResolution
-        )
-        mapmar_results_file.write(
-            "GRAVE_EqClass_Type+Place+Status+Urgency+Resolution_MAP: " + str(mymap) + "\n"
-        )
-        mapmar_results_file.write(
-            "GRAVE_EqClass_Type+Place+Status+Urgency+Resolution_MAR: " + str(mymar) + "\n"
-        )
+
+def genMAPMAR_results(filename, systemName, referenceTable, systemTable, alignment=None):
+    if alignment is None:
+        alignment = frame_alignment(systemTable, referenceTable)
+    scores = []
+    for genTrue, eqclass in MAPMAR_EQCLASSES:
+        mymap, mymar = mapmar(referenceTable, systemTable, genTrue, alignment)
+        scores += [(eqclass + "_MAP", mymap), (eqclass + "_MAR", mymar)]
+
+    referenceGrave = grave_frames(referenceTable)
+    systemGrave = grave_frames(systemTable)
+    mymap, mymar = mapmar(
+        referenceTable[referenceGrave],
+        systemTable[systemGrave],
+        genTrue_TypePlaceStatusUrgencyResolution,
+        subset_alignment(alignment, systemGrave, referenceGrave),
+    )
+    scores += [
+        ("GRAVE_EqClass_Type+Place+Status+Urgency+Resolution_MAP", mymap),
+        ("GRAVE_EqClass_Type+Place+Status+Urgency+Resolution_MAR", mymar),
+    ]
+    writeMAPMAR_results(filename, systemName, scores)
     return
 
 
+def genMAPMAR_systems(referenceTable, systemTable, systems=None, alignment=None):
+    """The scores of genMAPMAR_results of every system of a stacked submission table, as a
+    table of the value of every system_id and metric."""
+    systems = submission_systems(systemTable, systems)
+    if alignment is None:
+        alignment = frame_alignment(systemTable, referenceTable)
+    scores = []
+    for genTrue, eqclass in MAPMAR_EQCLASSES:
+        mymap, mymar = mapmar_systems(referenceTable, systemTable, genTrue, systems, alignment)
+        scores += [(eqclass + "_MAP", mymap), (eqclass + "_MAR", mymar)]
+
+    referenceGrave = grave_frames(referenceTable)
+    systemGrave = grave_frames(systemTable)
+    mymap, mymar = mapmar_systems(
+        referenceTable[referenceGrave],
+        systemTable[systemGrave],
+        genTrue_TypePlaceStatusUrgencyResolution,
+        systems,
+        subset_alignment(alignment, systemGrave, referenceGrave),
+    )
+    scores += [
+        ("GRAVE_EqClass_Type+Place+Status+Urgency+Resolution_MAP", mymap),
+        ("GRAVE_EqClass_Type+Place+Status+Urgency+Resolution_MAR", mymar),
+    ]
+    return pd.DataFrame(
+        {
+            "system_id": np.tile(np.asarray(systems, dtype=object), len(scores)),
+            "metric": np.repeat([name for name, values in scores], len(systems)),
+            "value": np.concatenate([values for name, values in scores]),
+        },
+        columns=["system_id", "metric", "value"],
+    )
+
+
+def summary_scores(mapmar, ndcg, precision, cutoffs=None):
+    """The genMAPMAR_systems, genNDCG_systems and precisionN_systems tables as one table of
+    the value of every system_id and metric, with the nDCG and precision at the cutoffs, or
+    at the last rank (@all) without them."""
+    if cutoffs:
+        ndcg = ndcg[np.in1d(ndcg["k"].values, cutoffs)]
+        precision = precision[np.in1d(precision["N"].values, cutoffs)]
+        ndcg_at = "@" + ndcg["k"].astype(str).values
+        precision_at = "P@" + precision["N"].astype(str).values
+    else:
+        ndcg = ndcg.drop_duplicates(subset=["system_id", "breakties", "method"], keep="last")
+        precision = precision.drop_duplicates(subset=["system_id"], keep="last")
+        ndcg_at, precision_at = "@all", "P@all"
+    scores = [
+        mapmar,
+        pd.DataFrame(
+            {
+                "system_id": ndcg["system_id"].values,
+                "metric": ndcg["breakties"].values + "_nDCG" + ndcg_at,
+                "value": ndcg["nDCG"].values,
+            }
+        ),
+        pd.DataFrame(
+            {
+                "system_id": precision["system_id"].values,
+                "metric": precision_at,
+                "value": precision["precision"].values,
+            }
+        ),
+    ]
+    return pd.concat(scores, ignore_index=True, sort=False)[["system_id", "metric", "value"]]
+
+
+def threshold_sweep(referenceTable, systemTable, thresholds, breakties=NDCG_BREAKTIES, method=0, cutoffs=None):
+    """The summary_scores of the submission table with gravity without the frames scored at or
+    below every threshold, as a table with a row per threshold. The thresholded tables are the
+    prefixes of one confidence sort, stacked and scored at once."""
+    thresholds = list(pd.unique(np.asarray(thresholds, dtype=float)))
+    confidence = systemTable["Confidence"].values.astype(float)
+    order = np.argsort(-confidence, kind="mergesort")
+    counts = np.searchsorted(-confidence[order], -np.asarray(thresholds), side="left")
+    # frames kept in submission order, so the sums of every situation add up the same way
+    rows = np.concatenate([np.zeros(0, dtype=int)] + [np.sort(order[:count]) for count in counts])
+    stacked = systemTable.iloc[rows].assign(system_id=np.repeat(thresholds, counts)).reset_index(drop=True)
+
+    referenceNDCG = getreferenceNDCG(referenceTable)
+    scores = summary_scores(
+        genMAPMAR_systems(referenceTable, stacked, thresholds),
+        genNDCG_systems(referenceNDCG, stacked, thresholds, breakties, [method]),
+        precisionN_systems(referenceNDCG, stacked, thresholds, cutoffs),
+        cutoffs,
+    )
+    sweep = scores.assign(system_id=scores["system_id"].astype(float)).pivot(
+        index="system_id", columns="metric", values="value"
+    )
+    sweep = sweep.reindex(index=thresholds, columns=pd.unique(scores["metric"].values))
+    sweep.index.name = "threshold"
+    sweep.columns.name = None
+    return sweep
+
+
 def genNDCG_results(filename, systemName, myndcg, k):
     with open(filename, "w") as nDCG_results_file:
         nDCG_results_file.write("SF nDCG Scores for Sysyem: " + systemName + "\n")
@@ -841,159 +1601,258 @@ def genprecisionN_results(filename, systemName, myprecisionN):
 
 #----------------------------------
 # Frame based presision recall functions
-def genpr_dt(systemTable,referenceTable, threshold):
-    systemTable_dt = systemTable[["DocumentID", "Type", "Confidence"]]
-    systemTable_dt = systemTable_dt.sort_values(by="Confidence", ascending=False).drop_duplicates(subset=["DocumentID", "Type"],keep='first')
-    referenceTable_dt = referenceTable[["doc_id", "type"]]
-    referenceTable_dt = referenceTable_dt.drop_duplicates()
-
-    merged = pd.merge(
-        systemTable_dt,
-        referenceTable_dt,
-        left_on=["DocumentID", "Type"],
-        right_on=["doc_id", "type"],
-        how="outer",
+PR_EQCLASS_KEYS = {
+    "Type": ["DocumentID", "Type"],
+    "TypePlace": ["DocumentID", "Type", "Place_KB_ID"],
+    "TypePlaceStatus": ["DocumentID", "Type", "Place_KB_ID", "Status"],
+    "TypePlaceStatusUrgency": ["DocumentID", "Type", "Place_KB_ID", "Status", "urgent"],
+    "TypePlaceStatusResolution": ["DocumentID", "Type", "Place_KB_ID", "Status", "unresolved"],
+    "TypePlaceStatusUrgencyResolution": [
+        "DocumentID", "Type", "Place_KB_ID", "Status", "urgent", "unresolved"
+    ],
+}
+
+REFERENCE_KEYS = {
+    "DocumentID": "doc_id",
+    "Type": "type",
+    "Place_KB_ID": "kb_id",
+    "Status": "status",
+    "urgent": "urgent",
+    "unresolved": "unresolved",
+}
+
+
+def genpr(alignment, eqclass, threshold, systems=None):
+    """Outer join of the distinct submission and reference keys of an equivalence class,
+    with the highest submission confidence of every key, derived from a frame alignment.
+    On a stacked submission table (see stacksubmissions) the keys are those of every system,
+    and threshold may be one per system."""
+    system, reference, pairs = alignment["system"], alignment["reference"], alignment["pairs"]
+    stacked = "system_id" in system.columns
+    keys = (["system_id"] if stacked else []) + PR_EQCLASS_KEYS[eqclass]
+    refkeys = [REFERENCE_KEYS.get(key, key) for key in keys]
+    matched = pairs[pairs[eqclass]]
+
+    systemTable_eq = system[keys + ["Confidence"]].assign(
+        label=system["sys_pos"].isin(matched["sys_pos"]).values.astype(int)
     )
-
-    merged["tp"]=merged.apply(lambda x: 1 if (x["DocumentID"]==x["doc_id"]) and (x["Type"]==x["type"]) else 0, axis=1)
-    merged["fn"]=merged.apply(lambda x: 1 if pd.isna(x["DocumentID"]) and pd.isna(x["Type"]) else 0, axis=1)
-    merged["fp"]=merged.apply(lambda x: 1 if pd.isna(x["doc_id"]) and pd.isna(x["type"]) else 0, axis=1)
-    merged["label"]=merged.apply(lambda x: 1 if not pd.isna(x["doc_id"]) and not pd.isna(x["type"]) else 0, axis=1)
-    merged["pred"]=merged.apply(lambda x: 1 if x["Confidence"] > threshold else 0, axis=1)
-    merged.Confidence = merged.Confidence.fillna(0)
-    merged.sort_values(by="Confidence", ascending=False, inplace=True)
-    return merged
-
-def genpr_dtp(systemTable,referenceTable, threshold):
-    systemTable_dtp = systemTable[["DocumentID", "Type","Place_KB_ID", "Confidence"]]
-    systemTable_dtp = systemTable_dtp.sort_values(by="Confidence", ascending=False).drop_duplicates(subset=["DocumentID", "Type","Place_KB_ID"],keep='first')
-    referenceTable_dtp = referenceTable[["doc_id", "type", "kb_id"]]
-    referenceTable_dtp = referenceTable_dtp.drop_duplicates()
-
-    merged = pd.merge(
-        systemTable_dtp,
-        referenceTable_dtp,
-        left_on=["DocumentID", "Type", "Place_KB_ID"],
-        right_on=["doc_id", "type", "kb_id"],
-        how="outer",
+    systemTable_eq = systemTable_eq.sort_values(by="Confidence", ascending=False).drop_duplicates(
+        subset=keys, keep="first"
     )
-
-    merged["tp"]=merged.apply(lambda x: 1 if (x["DocumentID"]==x["doc_id"]) and (x["Type"]==x["type"]) and (x["Place_KB_ID"]==x["kb_id"]) else 0, axis=1)
-    merged["fn"]=merged.apply(lambda x: 1 if pd.isna(x["DocumentID"]) and pd.isna(x["Type"]) and pd.isna(x["Place_KB_ID"]) else 0, axis=1)
-    merged["fp"]=merged.apply(lambda x: 1 if pd.isna(x["doc_id"]) and pd.isna(x["type"]) and pd.isna(x["kb_id"]) else 0, axis=1)
-    merged["label"]=merged.apply(lambda x: 1 if not pd.isna(x["doc_id"]) and not pd.isna(x["type"]) and not pd.isna(x["kb_id"]) else 0, axis=1)
-    merged["pred"]=merged.apply(lambda x: 1 if x["Confidence"] > threshold else 0, axis=1)
-    merged.Confidence = merged.Confidence.fillna(0)
-    merged.sort_values(by="Confidence", ascending=False, inplace=True)
-    return merged
-
-def genpr_dtps(systemTable,referenceTable, threshold):
-    systemTable_dtps = systemTable[["DocumentID", "Type","Place_KB_ID","Status", "Confidence"]]
-    systemTable_dtps = systemTable_dtps.sort_values(by="Confidence", ascending=False).drop_duplicates(subset=["DocumentID", "Type","Place_KB_ID", "Status"],keep='first')
-    referenceTable_dtps = referenceTable[["doc_id", "type", "kb_id", "status"]]
-    referenceTable_dtps = referenceTable_dtps.drop_duplicates()
-
-    merged = pd.merge(
-        systemTable_dtps,
-        referenceTable_dtps,
-        left_on=["DocumentID", "Type", "Place_KB_ID","Status"],
-        right_on=["doc_id", "type", "kb_id", "status"],
-        how="outer",
+    systemTable_eq = systemTable_eq.assign(
+        **{
+            refkey: systemTable_eq[key].where(systemTable_eq["label"] == 1)
+            for key, refkey in zip(keys, refkeys)
+            if refkey != key
+        }
     )
-
-    merged["tp"]=merged.apply(lambda x: 1 if (x["DocumentID"]==x["doc_id"]) and (x["Type"]==x["type"]) and (x["Place_KB_ID"]==x["kb_id"]) and (x["Status"]==x["status"]) else 0, axis=1)
-    merged["fn"]=merged.apply(lambda x: 1 if pd.isna(x["DocumentID"]) and pd.isna(x["Type"]) and pd.isna(x["Place_KB_ID"]) else 0, axis=1)
-    merged["fp"]=merged.apply(lambda x: 1 if pd.isna(x["doc_id"]) and pd.isna(x["type"]) and pd.isna(x["kb_id"]) else 0, axis=1)
-    merged["label"]=merged.apply(lambda x: 1 if not pd.isna(x["doc_id"]) and not pd.isna(x["type"]) and not pd.isna(x["kb_id"]) else 0, axis=1)
-    merged["pred"]=merged.apply(lambda x: 1 if x["Confidence"] > threshold else 0, axis=1)
+    if stacked:
+        # the reference frames of every system, without those it matched
+        systems = submission_systems(system, systems)
+        width = int(reference["ref_pos"].max()) + 1 if reference.shape[0] else 0
+        code = np.repeat(np.arange(len(systems)), reference.shape[0])
+        rows = np.tile(np.arange(reference.shape[0]), len(systems))
+        found = np.in1d(
+            code * width + reference["ref_pos"].values[rows],
+            system_codes(matched, systems) * width + matched["ref_pos"].values,
+        )
+        referenceTable_eq = (
+            reference.iloc[rows[~found]][refkeys[1:]]
+            .assign(system_id=np.asarray(systems, dtype=object)[code[~found]])[refkeys]
+            .drop_duplicates()
+            .assign(label=1)
+        )
+    else:
+        referenceTable_eq = reference.loc[
+            ~reference["ref_pos"].isin(matched["ref_pos"]).values, refkeys
+        ].drop_duplicates().assign(label=1)
+
+    merged = pd.concat([systemTable_eq, referenceTable_eq], ignore_index=True, sort=False)
+    merged = merged[keys + ["Confidence"] + [k for k in refkeys if k not in keys] + ["label"]]
+    merged["tp"] = (merged["label"] == 1) & merged["Confidence"].notnull()
+    merged["fn"] = merged["Confidence"].isnull()
+    merged["fp"] = merged["label"] == 0
+    if np.ndim(threshold):
+        threshold = np.asarray(threshold, dtype=float)[system_codes(merged, systems)]
+    merged["pred"] = merged["Confidence"] > threshold
+    for column in ["tp", "fn", "fp", "label", "pred"]:
+        merged[column] = merged[column].astype(int)
     merged.Confidence = merged.Confidence.fillna(0)
     merged.sort_values(by="Confidence", ascending=False, inplace=True)
     return merged
 
 
-def genpr_dtpsu(systemTable,referenceTable, threshold):
-    systemTable_dtpsu = systemTable[["DocumentID", "Type","Place_KB_ID","Status","urgent", "Confidence"]]
-    systemTable_dtpsu = systemTable_dtpsu.sort_values(by="Confidence", ascending=False).drop_duplicates(subset=["DocumentID", "Type","Place_KB_ID", "Status", "urgent"],keep='first')
-    referenceTable_dtpsu = referenceTable[["doc_id", "type", "kb_id", "status", "urgent"]]
-    referenceTable_dtpsu = referenceTable_dtpsu.drop_duplicates()
-
-    merged = pd.merge(
-        systemTable_dtpsu,
-        referenceTable_dtpsu,
-        left_on=["DocumentID", "Type", "Place_KB_ID","Status", "urgent"],
-        right_on=["doc_id", "type", "kb_id", "status", "urgent"],
-        how="outer",
-    )
-
-    merged["tp"]=merged.apply(lambda x: 1 if (x["DocumentID"]==x["doc_id"]) and (x["Type"]==x["type"]) and (x["Place_KB_ID"]==x["kb_id"]) and (x["Status"]==x["status"]) else 0, axis=1)
-    merged["fn"]=merged.apply(lambda x: 1 if pd.isna(x["DocumentID"]) and pd.isna(x["Type"]) and pd.isna(x["Place_KB_ID"]) else 0, axis=1)
-    merged["fp"]=merged.apply(lambda x: 1 if pd.isna(x["doc_id"]) and pd.isna(x["type"]) and pd.isna(x["kb_id"]) else 0, axis=1)
-    merged["label"]=merged.apply(lambda x: 1 if not pd.isna(x["doc_id"]) and not pd.isna(x["type"]) and not pd.isna(x["kb_id"]) else 0, axis=1)
-    merged["pred"]=merged.apply(lambda x: 1 if x["Confidence"] > threshold else 0, axis=1)
-    merged.Confidence = merged.Confidence.fillna(0)
-    merged.sort_values(by="Confidence", ascending=False, inplace=True)
-    return merged
+def genpr_dt(systemTable, referenceTable, threshold, alignment=None):
+    if alignment is None:
+        alignment = frame_alignment(systemTable, referenceTable)
+    return genpr(alignment, "Type", threshold)
+
+
+def genpr_dtp(systemTable, referenceTable, threshold, alignment=None):
+    if alignment is None:
+        alignment = frame_alignment(systemTable, referenceTable)
+    return genpr(alignment, "TypePlace", threshold)
+
+
+def genpr_dtps(systemTable, referenceTable, threshold, alignment=None):
+    if alignment is None:
+        alignment = frame_alignment(systemTable, referenceTable)
+    return genpr(alignment, "TypePlaceStatus", threshold)
+
+
+def genpr_dtpsu(systemTable, referenceTable, threshold, alignment=None):
+    if alignment is None:
+        alignment = frame_alignment(systemTable, referenceTable)
+    return genpr(alignment, "TypePlaceStatusUrgency", threshold)
+
+
+def genpr_dtpsr(systemTable, referenceTable, threshold, alignment=None):
+    if alignment is None:
+        alignment = frame_alignment(systemTable, referenceTable)
+    return genpr(alignment, "TypePlaceStatusResolution", threshold)
+
+
+def genpr_dtpsur(systemTable, referenceTable, threshold, alignment=None):
+    if alignment is None:
+        alignment = frame_alignment(systemTable, referenceTable)
+    return genpr(alignment, "TypePlaceStatusUrgencyResolution", threshold)
+
+
+def precision_recall_scores(labels, scores, threshold):
+    """Precision-recall curve and average precision (as sklearn's precision_recall_curve
+    and average_precision_score) together with precision, recall and F1 of the frames
+    scored above threshold, and the threshold among the confidences maximizing F1 with its
+    precision, recall and F1, all from one confidence sort."""
+    labels = np.asarray(labels, dtype=float)
+    scores = np.asarray(scores, dtype=float)
+    if labels.size == 0:
+        # No curve can be drawn; the thresholded scores are 0, as sklearn reports them.
+        return {"precision": None, "recall": None, "thresholds": None, "AP": None,
+                "Precision": 0.0, "Recall": 0.0, "F1": 0.0, "OptimalThreshold": None,
+                "OptimalPrecision": 0.0, "OptimalRecall": 0.0, "OptimalF1": 0.0}
+
+    order = np.argsort(scores, kind="mergesort")[::-1]
+    scores, labels = scores[order], labels[order]
+    cumulative_tps = np.cumsum(labels)
+    threshold_idxs = np.r_[np.where(np.diff(scores))[0], scores.size - 1]
+    tps = cumulative_tps[threshold_idxs]
+    fps = 1 + threshold_idxs - tps
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = tps / (tps + fps)
+        precision[np.isnan(precision)] = 0
+        recall = tps / tps[-1]
+    last_ind = tps.searchsorted(tps[-1])
+    sl = slice(last_ind, None, -1)
+    precision_curve = np.r_[precision[sl], 1]
+    recall_curve = np.r_[recall[sl], 0]
+    ap = -np.sum(np.diff(recall_curve) * precision_curve[:-1])
+
+    predicted = int(np.sum(scores > threshold))
+    tp = cumulative_tps[predicted - 1] if predicted else 0.0
+    P = tp / predicted if predicted else 0.0
+    R = tp / cumulative_tps[-1] if cumulative_tps[-1] else 0.0
+    # as sklearn's f1_score, from the counts: 2 tp / (2 tp + fp + fn)
+    F1 = 2 * tp / (predicted + cumulative_tps[-1]) if tp else 0.0
+
+    # the same scores with every distinct confidence as the threshold, from the highest: the
+    # frames scored above it are those before its block. With positive confidences only, a
+    # threshold of 0 keeps all the frames.
+    threshold_at = scores[threshold_idxs]
+    predicted_at = np.r_[0, threshold_idxs[:-1] + 1]
+    tp_at = np.r_[0.0, tps[:-1]]
+    if scores[-1] > 0:
+        threshold_at = np.r_[threshold_at, 0.0]
+        predicted_at = np.r_[predicted_at, scores.size]
+        tp_at = np.r_[tp_at, tps[-1]]
+    P_at = np.zeros(tp_at.size)
+    np.divide(tp_at, predicted_at, out=P_at, where=predicted_at > 0)
+    R_at = np.zeros(tp_at.size)
+    if cumulative_tps[-1]:
+        R_at = tp_at / cumulative_tps[-1]
+    F1_at = np.zeros(tp_at.size)
+    np.divide(2 * tp_at, predicted_at + cumulative_tps[-1], out=F1_at, where=tp_at > 0)
+    # the highest of the thresholds reaching the best F1
+    best = int(np.argmax(F1_at))
+    return {
+        "precision": precision_curve,
+        "recall": recall_curve,
+        "thresholds": scores[threshold_idxs][sl],
+        "AP": ap,
+        "Precision": P,
+        "Recall": R,
+        "F1": F1,
+        "OptimalThreshold": threshold_at[best],
+        "OptimalPrecision": P_at[best],
+        "OptimalRecall": R_at[best],
+        "OptimalF1": F1_at[best],
+    }
 
-def genpr_dtpsr(systemTable,referenceTable, threshold):
-    systemTable_dtpsr = systemTable[["DocumentID", "Type","Place_KB_ID","Status","unresolved", "Confidence"]]
-    systemTable_dtpsr = systemTable_dtpsr.sort_values(by="Confidence", ascending=False).drop_duplicates(subset=["DocumentID", "Type","Place_KB_ID", "Status", "unresolved"],keep='first')
-    referenceTable_dtpsr = referenceTable[["doc_id", "type", "kb_id", "status", "unresolved"]]
-    referenceTable_dtpsr = referenceTable_dtpsr.drop_duplicates()
 
-    merged = pd.merge(
-        systemTable_dtpsr,
-        referenceTable_dtpsr,
-        left_on=["DocumentID", "Type", "Place_KB_ID","Status", "unresolved"],
-        right_on=["doc_id", "type", "kb_id", "status", "unresolved"],
-        how="outer",
+def precision_recall_systems(merged, threshold, systems):
+    """Precision, recall and F1 of the frames scored above threshold (one per system or a
+    single one), as precision_recall_scores, and average precision of every system of a
+    stacked genpr table at once, as a table with a row per system_id."""
+    nsystems = len(systems)
+    code = system_codes(merged, systems)
+    labels = merged["label"].values.astype(float)
+    scores = merged["Confidence"].values.astype(float)
+    threshold = np.broadcast_to(np.asarray(threshold, dtype=float), (nsystems,))
+
+    above = scores > threshold[code]
+    predicted = np.bincount(code[above], minlength=nsystems)
+    tp = np.bincount(code[above], weights=labels[above], minlength=nsystems)
+    positives = np.bincount(code, weights=labels, minlength=nsystems)
+    P = np.zeros(nsystems)
+    np.divide(tp, predicted, out=P, where=predicted > 0)
+    R = np.zeros(nsystems)
+    np.divide(tp, positives, out=R, where=positives > 0)
+    F1 = np.zeros(nsystems)
+    np.divide(2 * tp, predicted + positives, out=F1, where=tp > 0)
+    return pd.DataFrame(
+        {
+            "system_id": list(systems),
+            "Precision": P,
+            "Recall": R,
+            "F1": F1,
+            "AP": segmented_average_precision(code, scores, labels, nsystems),
+        },
+        columns=["system_id", "Precision", "Recall", "F1", "AP"],
     )
 
-    merged["tp"]=merged.apply(lambda x: 1 if (x["DocumentID"]==x["doc_id"]) and (x["Type"]==x["type"]) and (x["Place_KB_ID"]==x["kb_id"]) and (x["Status"]==x["status"]) else 0, axis=1)
-    merged["fn"]=merged.apply(lambda x: 1 if pd.isna(x["DocumentID"]) and pd.isna(x["Type"]) and pd.isna(x["Place_KB_ID"]) else 0, axis=1)
-    merged["fp"]=merged.apply(lambda x: 1 if pd.isna(x["doc_id"]) and pd.isna(x["type"]) and pd.isna(x["kb_id"]) else 0, axis=1)
-    merged["label"]=merged.apply(lambda x: 1 if not pd.isna(x["doc_id"]) and not pd.isna(x["type"]) and not pd.isna(x["kb_id"]) else 0, axis=1)
-    merged["pred"]=merged.apply(lambda x: 1 if x["Confidence"] > threshold else 0, axis=1)
-    merged.Confidence = merged.Confidence.fillna(0)
-    merged.sort_values(by="Confidence", ascending=False, inplace=True)
-    return merged
 
-def genpr_dtpsur(systemTable,referenceTable, threshold):
-    systemTable_dtpsur = systemTable[["DocumentID", "Type","Place_KB_ID","Status","urgent","unresolved", "Confidence"]]
-    systemTable_dtpsur = systemTable_dtpsur.sort_values(by="Confidence", ascending=False).drop_duplicates(subset=["DocumentID", "Type","Place_KB_ID", "Status","urgent", "unresolved"],keep='first')
-    referenceTable_dtpsur = referenceTable[["doc_id", "type", "kb_id", "status","urgent", "unresolved"]]
-    referenceTable_dtpsur = referenceTable_dtpsur.drop_duplicates()
+def genF1_results(filename, eqclass, scores, f1label=None):
+    with open(filename, "w") as F_results_file:
+        F_results_file.write((f1label or "F1_" + eqclass) + ":\t" + str(scores["F1"]) + "\n")
+        F_results_file.write("Precision_" + eqclass + ":\t" + str(scores["Precision"]) + "\n")
+        F_results_file.write("Recall_" + eqclass + ":\t" + str(scores["Recall"]) + "\n")
+    return
 
-    merged = pd.merge(
-        systemTable_dtpsur,
-        referenceTable_dtpsur,
-        left_on=["DocumentID", "Type", "Place_KB_ID","Status", "urgent","unresolved"],
-        right_on=["doc_id", "type", "kb_id", "status","urgent", "unresolved"],
-        how="outer",
-    )
 
-    merged["tp"]=merged.apply(lambda x: 1 if (x["DocumentID"]==x["doc_id"]) and (x["Type"]==x["type"]) and (x["Place_KB_ID"]==x["kb_id"]) and (x["Status"]==x["status"]) else 0, axis=1)
-    merged["fn"]=merged.apply(lambda x: 1 if pd.isna(x["DocumentID"]) and pd.isna(x["Type"]) and pd.isna(x["Place_KB_ID"]) else 0, axis=1)
-    merged["fp"]=merged.apply(lambda x: 1 if pd.isna(x["doc_id"]) and pd.isna(x["type"]) and pd.isna(x["kb_id"]) else 0, axis=1)
-    merged["label"]=merged.apply(lambda x: 1 if not pd.isna(x["doc_id"]) and not pd.isna(x["type"]) and not pd.isna(x["kb_id"]) else 0, axis=1)
-    merged["pred"]=merged.apply(lambda x: 1 if x["Confidence"] > threshold else 0, axis=1)
-    merged.Confidence = merged.Confidence.fillna(0)
-    merged.sort_values(by="Confidence", ascending=False, inplace=True)
-    return merged
+def genOptimalF1_results(filename, optimal):
+    """Writes the F1-optimal threshold and its F1, precision and recall (precision_recall_scores)
+    of every (eqclass, scores) pair."""
+    with open(filename, "w") as F_results_file:
+        for eqclass, scores in optimal:
+            for score in ["Threshold", "F1", "Precision", "Recall"]:
+                F_results_file.write("Optimal" + score + "_" + eqclass + ":\t" + str(scores["Optimal" + score]) + "\n")
+    return
 
 
-def plotpr(filename, merged, header, sysname):
+def plotpr(filename, merged, header, sysname, scores=None):
     try:
-        #precision, recall, _ = precision_recall_curve(merged.label, merged.Confidence)
-        precision, recall, _ = precision_recall_curve(merged.label.values, merged.Confidence.values)
-        precision=precision[-2:0:-1]
-        recall=recall[-2:0:-1]
+        if scores is None:
+            scores = precision_recall_scores(merged.label.values, merged.Confidence.values, 0.0)
+        if scores["AP"] is None:
+            raise ValueError("Found array with 0 sample(s) while a minimum of 1 is required.")
+        precision = scores["precision"][-2:0:-1]
+        recall = scores["recall"][-2:0:-1]
         plt.step(recall, precision, color='b', alpha=0.2, where='post')
         plt.fill_between(recall, precision, alpha=0.2, color='b', step='post')
         plt.xlabel('Recall')
         plt.ylabel('Precision')
         #plt.ylim([0.0, 1.05])
         #plt.xlim([0.0, 1.0])
-        plt.title(header + '\nAP={0:0.2f}'.format(average_precision_score(merged.label, merged.Confidence)))
+        plt.title(header + '\nAP={0:0.2f}'.format(scores["AP"]))
     except ValueError:
         print("ValueError exception. No Precision-Recall curve will be created")
     else:
@@ -1,59 +1,67 @@
+import functools
+import hashlib
+import os
+import re
+
 import numpy as np
 import pandas as pd
-import glob
-import csv
-
-
-def get_SEC_ref(ref_path):
-    sentiment_files = glob.glob(ref_path + "/sentiments/*.tab")
-    sentiment_df_list = []
-    for file_ in sentiment_files:
-        df = pd.read_csv(
-            file_,
-            index_col=None,
-            header=0,
-            sep="\t",
-            quoting=csv.QUOTE_NONE,
-            dtype={"doc_id": object, "kb_id": object},
-            na_values=["none"],
-        )
-        sentiment_df_list.append(df)
-    all_sentiments_df = pd.concat(sentiment_df_list, axis=0, ignore_index=True)
-
-    return all_sentiments_df
 
 
-def preparing_SEC_submission(submission, ref_el, sub_el):
-
-    # flatten submission
-    # first group by
-    subm_grouped = submission[sub_el + ["SEC"]].groupby(sub_el)
-    list_of_pairs = [[*i, c] for i, b in subm_grouped["SEC"] for a in b.tolist() for c in a]
+SEC_EMOTIONS = ["Emotion_Anger", "Emotion_Fear", "Emotion_Joy"]
+
+
+def flatten_SEC(sec):
+    """The SEC blocks of every frame (sec, the SEC column of a submission) as one row each, with
+    the index label of their frame: Sentiment and the Emotion_* flags as floats (NaN when not
+    given), Source, and positive, whether Sentiment is positive."""
+    counts = [len(frameblocks) for frameblocks in sec.values]
+    blocks = [block for frameblocks in sec.values for block in frameblocks]
+    flat = pd.DataFrame({"frame": np.repeat(sec.index.values, counts)})
+    flat["Sentiment"] = np.array([block.get("Sentiment") for block in blocks], dtype=float)
+    flat["Source"] = np.array([block.get("Source") for block in blocks], dtype=object)
+    for emotion in SEC_EMOTIONS:
+        flat[emotion] = np.array([block.get(emotion) for block in blocks], dtype=float)
+    with np.errstate(invalid="ignore"):
+        flat["positive"] = flat["Sentiment"].values > 0
+    return flat
+
+
+def preparing_SEC_submission(submission, ref_el, sub_el, blocks=None):
+    """One row per SEC block of the submission, in frame order, with the frame columns sub_el
+    renamed to ref_el. blocks are the flattened SEC blocks (flatten_SEC) of a table the
+    submission is a subset of, flattened from the submission itself if not given."""
+    if blocks is None:
+        blocks = flatten_SEC(submission["SEC"].reset_index(drop=True))
+        frame = blocks["frame"].values
+    else:
+        frame = submission.index.get_indexer(blocks["frame"].values)
+        order = np.argsort(frame, kind="mergesort")
+        order = order[frame[order] >= 0]
+        blocks, frame = blocks.iloc[order], frame[order]
 
-    if len(list_of_pairs) == 0:
+    if len(blocks) == 0:
         return pd.DataFrame()
 
-    # flattening subm sentiments: each SEC element now has a row
-    # also renaming the columns to match the ref nameing
-    flat = pd.DataFrame(list_of_pairs, columns=ref_el + ["sentiments"])
-    sentiment_as_series = flat.apply(lambda r: pd.Series(r["sentiments"]), axis=1, reduce=True)
-    # setting polarity to match reference naming
-    sentiment_as_series["polarity"] = sentiment_as_series["Sentiment"].apply(
-        lambda x: "positive" if x > 0 else "negative"
+    subm_sentiments_df = pd.DataFrame(
+        {r: submission[s].values[frame] for r, s in zip(ref_el, sub_el)}, columns=ref_el
     )
-    # merging back with the full submission info
-    subm_sentiments_df = pd.merge(
-        flat, sentiment_as_series, left_index=True, right_index=True
-    ).drop(["sentiments"], axis=1)
-
-    subm_sentiments_df.set_index(ref_el)
+    for column in ["Sentiment", "Source"] + SEC_EMOTIONS:
+        subm_sentiments_df[column] = blocks[column].values
+    # setting polarity to match reference naming
+    subm_sentiments_df["polarity"] = np.where(blocks["positive"].values, "positive", "negative").astype(object)
 
     return subm_sentiments_df
 
 
-def preparing_SEC_reference(reference, sec_ref, ref_el):
-    ref_fields = ref_el + ["frame_id", "kb_id"]
-    sec_ref["kb_id_sentiments"] = sec_ref["kb_id"]
+def class_SEC_submission(subm_sentiments_df, ref_el):
+    """The flattened submission sentiments of the frames with all the ref_el columns, in the
+    order of a groupby on them."""
+    subm_sentiments_df = subm_sentiments_df[subm_sentiments_df[ref_el].notnull().all(axis=1).values]
+    return subm_sentiments_df.sort_values(ref_el, kind="mergesort").reset_index(drop=True)
+
+
+def preparing_SEC_reference(reference, sec_ref):
+    sec_ref = sec_ref.assign(kb_id_sentiments=sec_ref["kb_id"])
     # supplement SEC ref with regular ref information
     ref_sentiments_with_type = pd.merge(
         sec_ref,
@@ -90,117 +98,53 @@ def preparing_SEC_reference(reference, sec_ref, ref_el):
     return ref_sentiments_with_type
 
 
-def matching_frames(row, df, ref_el):
-    """For each submission frame, returns all the matching reference frames"""
-
-    masks = [df[e] == row[e] for e in ref_el]
-    # true mask of right size
-    mask = pd.Series([True for _ in range(0, len(df))])
-    # make & of all masks
-    for m in masks:
-        mask = mask & m
-
-    return df[mask]
-
-
-def is_sentiment_match(ref, sub):
-    return ref["polarity"] == sub["polarity"] and ref["kb_id_sentiments"] == sub["Source"]
-
-
-def matching_sentiments(row, inverted=False):
-    """default order: row is a reference row, x is a submission row. inverted=True inverts that"""
-
-    def is_sentiment_match_func(x):
-        if inverted:
-            return is_sentiment_match(ref=row, sub=x)
-        else:
-            return is_sentiment_match(ref=x, sub=row)
-
-    matching_frames = row["matching_frames"]  # this is a dataframe
-    filtered_frames = matching_frames.apply(is_sentiment_match_func, axis=1)
-    return matching_frames[filtered_frames]
-
-
-def penalty(row, penalty_factor=0.97, matching_key="matching_ref_sentiments"):
-    subm_value = float(row["Sentiment"])
-    ref_value = float(row[matching_key].iloc[[0]]["sentiment_value"])
-
-    diff = abs(subm_value - ref_value)
-    if diff <= 0.5:
-        return 1.0
-    elif 0.5 < diff <= 1.5:
-        return penalty_factor
-    else:
-        return penalty_factor ** 2
-
-
-def emotion_matches(row):
-    columns = ["Emotion_Anger", "Emotion_Fear", "Emotion_Joy"]
-    ref_df = row["matching_ref_sentiments"]
-
-    if len(ref_df) == 0:
-        return 0, 3
-
-    matched_reference = ref_df.iloc[0][columns]
-
-    matches = sum(row[c] == matched_reference[c] for c in columns)
-    #     matches = sum(row[[columns]] & matched_reference)
-    return matches, 3 - matches
-
-
-def SEC_scoring(
-    reference,
-    sec_ref,
-    submission,
-    mapping,
-    ref_el=["doc_id", "kb_id", "type"],
-    sub_el=["DocumentID", "Place_KB_ID", "Type"]
-):
-    if not mapping:
-        mapping = DictWithMissing(dict())
+def sentiment_keys(df, columns, position):
+    """The columns of df as object typed merge keys, with the position of every row in df.
+    Rows with a missing key are left out, since they match nothing."""
+    keys = pd.DataFrame({"key%d" % i: df[c].values.astype(object) for i, c in enumerate(columns)})
+    keys[position] = np.arange(len(df))
+    return keys[keys.drop(position, axis=1).notnull().all(axis=1).values]
 
-    ref_sentiments_with_type = preparing_SEC_reference(reference, sec_ref, ref_el)
 
-    # case where no sentiments in the reference
-    if len(ref_sentiments_with_type) == 0:
-        return 9*[np.NAN]
+def matching_sentiments(subm_sentiments_df, ref_sentiments_with_type, ref_el):
+    """All (submission, reference) pairs of sentiments of matching frames (ref_el) with the same
+    polarity and source, as row positions in the two tables, sorted by submission then reference."""
+    sub_keys = sentiment_keys(subm_sentiments_df, ref_el + ["polarity", "Source"], "sub")
+    ref_keys = sentiment_keys(ref_sentiments_with_type, ref_el + ["polarity", "kb_id_sentiments"], "ref")
+    keys = ["key%d" % i for i in range(len(ref_el) + 2)]
+    pairs = pd.merge(sub_keys, ref_keys, how="inner", on=keys)[["sub", "ref"]]
+    return pairs.sort_values(["sub", "ref"])
 
-    subm_sentiments_df = preparing_SEC_submission(submission, ref_el, sub_el)
 
-    # case where no sentiments reported by submission
-    if len(subm_sentiments_df) == 0:
-        return 9*[0]
+def penalty(subm_value, ref_value, penalty_factor=0.97):
+    diff = np.abs(np.asarray(subm_value, dtype=float) - np.asarray(ref_value, dtype=float))
+    with np.errstate(invalid="ignore"):
+        return np.where(diff <= 0.5, 1.0, np.where(diff <= 1.5, penalty_factor, penalty_factor ** 2))
 
-    subm_sentiments_df["kb_id"] = subm_sentiments_df["kb_id"].map(mapping)
 
-    # from the POV of the submission, get all matching reference FRAMES
-    subm_sentiments_df["matching_frames"] = subm_sentiments_df.apply(
-        matching_frames, axis=1, args=(ref_sentiments_with_type, ref_el)
-    )
-    # from those matching FRAMES, extract the matching SENTIMENTS
-    subm_sentiments_df["matching_ref_sentiments"] = subm_sentiments_df.apply(
-        matching_sentiments, axis=1
-    )
+def emotion_matches(subm_emotions, ref_emotions):
+    """Number of the emotions on which every submission sentiment agrees with its reference."""
+    matches = np.asarray(subm_emotions, dtype=object) == np.asarray(ref_emotions, dtype=object)
+    return matches.astype(bool).sum(axis=1)
 
-    # from the POV of the reference, get all matching submission FRAMES
-    ref_sentiments_with_type["matching_frames"] = ref_sentiments_with_type.apply(
-        matching_frames, axis=1, args=(subm_sentiments_df, ref_el)
-    )
-    ref_sentiments_with_type["matching_sub_sentiments"] = ref_sentiments_with_type.apply(
-        matching_sentiments, axis=1, args=(True,)
-    )
 
-    matches = subm_sentiments_df["matching_ref_sentiments"].apply(lambda x: len(x))
-    single_matches = matches[matches == 1]
+def SEC_class_scores(ref_sentiments_with_type, subm_sentiments_df, ref_el):
+    """The SEC metrics of the prepared reference and submission sentiments, matching frames
+    on the ref_el columns."""
+    pairs = matching_sentiments(subm_sentiments_df, ref_sentiments_with_type, ref_el)
+    matches = np.bincount(pairs["sub"].values, minlength=len(subm_sentiments_df))
 
     # all the SEC groups that match at least one reference are a TP
-    tp_matches = matches[matches >= 1]
-    tp = len(tp_matches)
+    tp = int((matches >= 1).sum())
     # all the SEC groups that match 0 reference are a FP
-    fp = len(matches[matches == 0])
+    fp = int((matches == 0).sum())
     # from the ref POV, all the ref SEC groups that match 0 submission are a FN
-    ref_matches = ref_sentiments_with_type["matching_sub_sentiments"].apply(lambda x: len(x))
-    fn = len(ref_matches) - len(ref_matches[ref_matches >= 1])
+    fn = len(ref_sentiments_with_type) - len(np.unique(pairs["ref"].values))
+
+    # the sentiment value and emotions of a TP are compared with its first matching reference
+    first = pairs.drop_duplicates("sub")
+    matched_sub = subm_sentiments_df.iloc[first["sub"].values]
+    matched_ref = ref_sentiments_with_type.iloc[first["ref"].values]
 
     PrecisionPolarity = tp / (tp + fp)
     RecallPolarity = tp / (tp + fn)
@@ -212,8 +156,8 @@ def SEC_scoring(
     # SENTIMENT VALUE SECTION
 
     # penalized TP
-    penalized_tp = subm_sentiments_df[matches >= 1].apply(penalty, axis=1, result_type="reduce")
-    total_penalty = sum(penalized_tp)
+    penalized_tp = penalty(matched_sub["Sentiment"].values, matched_ref["sentiment_value"].values)
+    total_penalty = sum(penalized_tp.tolist())
 
     PrecisionSentiment = total_penalty / (tp + fp)
     RecallSentiment = total_penalty / (tp + fn)
@@ -226,10 +170,13 @@ def SEC_scoring(
 
     ## EMOTION SECTION
 
-    matches, non_matches = zip(*subm_sentiments_df.apply(emotion_matches, axis=1))
+    # SEC groups without a matching reference match no emotion
+    matches = 0
+    if len(first):
+        matches = int(emotion_matches(matched_sub[SEC_EMOTIONS].values, matched_ref[SEC_EMOTIONS].values).sum())
 
-    PrecisionEmotion = sum(matches) / (3 * len(subm_sentiments_df))
-    RecallEmotion = sum(matches) / (3 * len(ref_sentiments_with_type))
+    PrecisionEmotion = matches / (3 * len(subm_sentiments_df))
+    RecallEmotion = matches / (3 * len(ref_sentiments_with_type))
     try:
         F1Emotion = 2 * PrecisionEmotion * RecallEmotion / (PrecisionEmotion + RecallEmotion)
     except ZeroDivisionError:
@@ -251,28 +198,51 @@ def SEC_scoring(
     )
 
 
-def sub_nil_to_ref(nil_id, ref_df, sub_df):
-    """Extract corresponding KBid for a submission NIL id"""
+def SEC_scores(reference, sec_ref, submission, mapping, pairs_to_match_frames, blocks=None):
+    """SEC_scoring for every (ref_el, sub_el, name) of pairs_to_match_frames. The reference and
+    submission sentiments are prepared once, only the matching is done for every class. blocks
+    are the flattened SEC blocks of the submission (see preparing_SEC_submission)."""
+    if not mapping:
+        mapping = DictWithMissing(dict())
 
-    matching_sub_rows = sub_df[sub_df["kbid"] == nil_id]
-    matching_ref_for_nil_id = matching_sub_rows.apply(
-        corresponding_ref_rows, args=(ref_df,), axis=1
-    )
-    concatenated = pd.concat(matching_ref_for_nil_id.tolist())
+    ref_sentiments_with_type = preparing_SEC_reference(reference, sec_ref)
 
-    # this is where the extra condition would go
-    if len(concatenated) == 0:
-        return 'None'
+    # case where no sentiments in the reference
+    if len(ref_sentiments_with_type) == 0:
+        return [9*[np.NAN] for _ in pairs_to_match_frames]
+
+    # flatten the submission with the frame columns of all the classes
+    columns = {}
+    for ref_el, sub_el, _ in pairs_to_match_frames:
+        columns.update(zip(ref_el, sub_el))
+    subm_sentiments_df = preparing_SEC_submission(
+        submission, list(columns), list(columns.values()), blocks
+    )
 
-    return str(concatenated.iloc[0]["kbid"])
+    scores = []
+    for ref_el, _, _ in pairs_to_match_frames:
+        class_sentiments_df = subm_sentiments_df
+        if len(class_sentiments_df):
+            class_sentiments_df = class_SEC_submission(subm_sentiments_df, ref_el)
+            class_sentiments_df["kb_id"] = class_sentiments_df["kb_id"].map(mapping)
 
+        # case where no sentiments reported by submission
+        if len(class_sentiments_df) == 0:
+            scores.append(9*[0])
+        else:
+            scores.append(SEC_class_scores(ref_sentiments_with_type, class_sentiments_df, ref_el))
+    return scores
 
-def corresponding_ref_rows(row, ref_df):
-    def condition_on_doc_and_range(ref, sub):
-        return ref["doc_and_range"] == sub["doc_and_range"]
 
-    matching_ref_rows = ref_df[condition_on_doc_and_range(ref_df, row)]
-    return matching_ref_rows
+def SEC_scoring(
+    reference,
+    sec_ref,
+    submission,
+    mapping,
+    ref_el=["doc_id", "kb_id", "type"],
+    sub_el=["DocumentID", "Place_KB_ID", "Type"]
+):
+    return SEC_scores(reference, sec_ref, submission, mapping, [(ref_el, sub_el, None)])[0]
 
 
 class DictWithMissing(dict):
@@ -285,18 +255,208 @@ class DictWithMissing(dict):
         return key
 
 
-def nil_mapper(subm_edl_file, ref_edl_file):
-    header = ["team", "mid", "loc", "doc_and_range", "kbid", "type", "otype", "conf"]
-    kwargs = dict(delimiter="\t", names=header)
-    ref_edl = pd.read_csv(ref_edl_file, header=0, **kwargs)
-    sub_edl = pd.read_csv(subm_edl_file, header=None, **kwargs)
+EDL_COLUMNS = ["team", "mid", "loc", "doc_and_range", "kbid", "type", "otype", "conf"]
 
-    # NIL only
-    sub_nil_ids = sub_edl["kbid"][sub_edl["kbid"].str.startswith("NIL")].drop_duplicates()
-    # get corresponding NILs from reference
-    corr_nils = sub_nil_ids.apply(sub_nil_to_ref, args=(ref_edl, sub_edl))
-    # dataframe with subm NIL as the index
-    mapped_nils = pd.DataFrame([corr_nils]).transpose().set_index(sub_nil_ids)
+# bump when the EDL indexes change, to invalidate existing ones
+EDL_INDEX_VERSION = 1
 
-    return DictWithMissing(mapped_nils.to_dict()["kbid"])
+# larger start and end offsets of EDL extents are clipped
+EDL_SPAN_LIMIT = 2 ** 31 - 1
 
+
+def read_edl(edl_file, header, docs=None):
+    """The doc_and_range and kbid columns of an EDL file, restricted to the mentions
+    of the documents in docs if given."""
+    edl = pd.read_csv(
+        edl_file,
+        delimiter="\t",
+        header=header,
+        names=EDL_COLUMNS,
+        usecols=["doc_and_range", "kbid"],
+    )
+    if docs is not None:
+        edl = edl[edl["doc_and_range"].str.rpartition(":")[0].isin(docs).values]
+    return edl
+
+
+def edl_fingerprint(edl_file):
+    """Hash of the content of an EDL file."""
+    fingerprint = hashlib.sha1(repr((EDL_INDEX_VERSION, pd.__version__)).encode())
+    with open(edl_file, "rb") as f:
+        for block in iter(functools.partial(f.read, 1 << 20), b""):
+            fingerprint.update(block)
+    return fingerprint.hexdigest()
+
+
+def build_edl_index(ref_edl_file):
+    """Every extent (doc_and_range) of the reference EDL, sorted, with the KB id of its
+    first mention in file order."""
+    ref_edl = read_edl(ref_edl_file, 0)
+    ref_edl = ref_edl[ref_edl["doc_and_range"].notnull().values]
+    extents, first = np.unique(ref_edl["doc_and_range"].values.astype(str), return_index=True)
+    kbids = np.array([str(k) for k in ref_edl["kbid"].values[first]], dtype=str)
+    index = np.empty(len(extents), dtype=[("doc_and_range", extents.dtype), ("kbid", kbids.dtype)])
+    index["doc_and_range"] = extents
+    index["kbid"] = kbids
+    return index
+
+
+def edl_index(ref_edl_file, cachedir=None, policy="exact"):
+    """The index of the reference EDL used by the NIL matching policy. With cachedir the index
+    is saved there, named by the content hash of the EDL file, and memory-mapped by later runs
+    instead of parsing the EDL file again."""
+    build_index = EDL_INDEX_BUILDERS[policy]
+    if not cachedir:
+        return build_index(ref_edl_file)
+
+    indexfile = os.path.join(
+        cachedir, "edl_" + policy + "_" + edl_fingerprint(ref_edl_file) + ".npy"
+    )
+    if os.path.exists(indexfile):
+        try:
+            index = np.load(indexfile, mmap_mode="r")
+            print("Using cached EDL reference index: " + indexfile)
+            return index
+        except Exception as e:
+            print("Ignoring unreadable EDL reference index " + indexfile + ": " + str(e))
+
+    index = build_index(ref_edl_file)
+    try:
+        if not os.path.exists(cachedir):
+            os.makedirs(cachedir)
+        tmpfile = indexfile + "." + str(os.getpid())
+        with open(tmpfile, "wb") as f:
+            np.save(f, index)
+        os.replace(tmpfile, indexfile)
+    except OSError as e:
+        print("CAN NOT WRITE EDL REFERENCE INDEX: " + indexfile + ": " + str(e))
+    return index
+
+
+def probe_edl_index(index, extents):
+    """Whether every extent is in the EDL index, and the KB id of its first reference mention."""
+    extents = np.asarray(extents).astype(str)
+    if len(index) == 0:
+        return np.zeros(len(extents), dtype=bool), np.full(len(extents), "", dtype=str)
+    position = np.searchsorted(index["doc_and_range"], extents).clip(max=len(index) - 1)
+    entries = index[position]
+    return entries["doc_and_range"] == extents, entries["kbid"]
+
+
+EXTENT = re.compile(r"^(.*):(\d{1,18})-(\d{1,18})$")
+
+
+def parse_extents(extents):
+    """doc, start and end of every doc_and_range "doc:start-end", and whether it could be parsed."""
+    matches = [EXTENT.match(e) if isinstance(e, str) else None for e in extents]
+    spans = [(m.group(1), int(m.group(2)), int(m.group(3))) if m else ("", -1, -1) for m in matches]
+    doc, start, end = zip(*spans) if spans else ((), (), ())
+    start = np.array(start, dtype=np.int64).clip(max=EDL_SPAN_LIMIT)
+    end = np.array(end, dtype=np.int64).clip(max=EDL_SPAN_LIMIT)
+    valid = np.array([m is not None for m in matches], dtype=bool)
+    return np.array(doc, dtype=object), start, end, valid & (start <= end)
+
+
+def build_edl_interval_index(ref_edl_file):
+    """The parsed extents of the reference EDL sorted by document and start, with the KB id and
+    file position of every mention. key and keyend are the start and the running maximum of the
+    end within the document, offset by the rank of the document, so both are sorted."""
+    ref_edl = read_edl(ref_edl_file, 0)
+    ref_edl = ref_edl[ref_edl["doc_and_range"].notnull().values]
+    doc, start, end, valid = parse_extents(ref_edl["doc_and_range"].values)
+    position = np.arange(len(ref_edl))[valid]
+    doc, start, end = doc[valid].astype(str), start[valid], end[valid]
+    kbids = np.array([str(k) for k in ref_edl["kbid"].values[valid]], dtype=str)
+
+    order = np.lexsort((position, end, start, doc))
+    docs, docrank = np.unique(doc[order], return_inverse=True)
+    index = np.empty(
+        len(order),
+        dtype=[
+            ("doc", doc.dtype),
+            ("docrank", np.int64),
+            ("start", np.int64),
+            ("end", np.int64),
+            ("key", np.int64),
+            ("keyend", np.int64),
+            ("position", np.int64),
+            ("kbid", kbids.dtype),
+        ],
+    )
+    index["doc"] = doc[order]
+    index["docrank"] = docrank
+    index["start"] = start[order]
+    index["end"] = end[order]
+    index["key"] = docrank * (EDL_SPAN_LIMIT + 1) + start[order]
+    maxend = pd.Series(end[order]).groupby(docrank).cummax().values
+    index["keyend"] = docrank * (EDL_SPAN_LIMIT + 1) + maxend
+    index["position"] = position[order]
+    index["kbid"] = kbids[order]
+    return index
+
+
+def probe_edl_intervals(index, extents):
+    """Whether every extent overlaps a mention of the same document in the EDL interval index,
+    and the KB id of the mention overlapping it most (then the closest in length, then the first
+    in file order)."""
+    doc, start, end, valid = parse_extents(extents)
+    found = np.zeros(len(doc), dtype=bool)
+    kbids = np.full(len(doc), "", dtype=index["kbid"].dtype)
+    if len(index) == 0:
+        return found, kbids
+
+    # candidates: mentions of the document starting before the end of the extent, from the
+    # first one whose running maximum end reaches its start
+    # the documents are looked up once each
+    doccodes, docs = pd.factorize(doc)
+    docs = docs.astype(str)
+    doclo = np.searchsorted(index["doc"], docs).clip(max=len(index) - 1)
+    docfound = index["doc"][doclo] == docs
+    doclo, valid = doclo[doccodes], valid & docfound[doccodes]
+    offset = index["docrank"][doclo] * (EDL_SPAN_LIMIT + 1)
+    lo = np.searchsorted(index["keyend"], offset + start)
+    hi = np.searchsorted(index["key"], offset + end, side="right")
+    counts = np.where(valid, hi - lo, 0).clip(min=0)
+
+    extent = np.repeat(np.arange(len(doc)), counts)
+    row = lo[extent] + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    candidates = index[row]
+    overlap = np.minimum(candidates["end"], end[extent]) - np.maximum(candidates["start"], start[extent]) + 1
+    lengthdiff = np.abs((candidates["end"] - candidates["start"]) - (end[extent] - start[extent]))
+    keep = overlap > 0
+    extent, overlap, lengthdiff, candidates = extent[keep], overlap[keep], lengthdiff[keep], candidates[keep]
+
+    best = np.lexsort((candidates["position"], lengthdiff, -overlap, extent))
+    best = best[np.r_[True, np.diff(extent[best]) != 0]] if len(best) else best
+    found[extent[best]] = True
+    kbids[extent[best]] = candidates["kbid"][best]
+    return found, kbids
+
+
+# "exact" matches the extents (doc_and_range) of submission and reference mentions as
+# strings, "overlap" matches a submission mention to the reference mention of the same
+# document that overlaps it most
+NIL_MATCH_POLICIES = ["exact", "overlap"]
+EDL_INDEX_BUILDERS = {"exact": build_edl_index, "overlap": build_edl_interval_index}
+EDL_INDEX_PROBES = {"exact": probe_edl_index, "overlap": probe_edl_intervals}
+
+
+def nil_mapper(subm_edl_file, ref_edl_file, docs=None, cachedir=None, policy="exact", index=None):
+    """Maps every NIL KB id of the submission EDL to the KB id of the reference mention
+    matching its first matched mention (see NIL_MATCH_POLICIES), or to 'None'. With the
+    "exact" policy that is the first reference mention (in file order) with the same extent.
+    index is the edl_index of the reference EDL for the policy, when already loaded."""
+    if index is None:
+        index = edl_index(ref_edl_file, cachedir, policy)
+    sub_edl = read_edl(subm_edl_file, None, docs)
+
+    # NIL only
+    sub_nils = sub_edl[sub_edl["kbid"].str.startswith("NIL").values]
+    mapped_nils = dict.fromkeys(sub_nils["kbid"].tolist(), "None")
+    # get corresponding NILs from reference, from the first submission mention with one
+    sub_nils = sub_nils[sub_nils["doc_and_range"].notnull().values]
+    found, kbids = EDL_INDEX_PROBES[policy](index, sub_nils["doc_and_range"].values)
+    corr_nils = sub_nils[found].assign(kbid_ref=kbids[found].tolist()).drop_duplicates("kbid")
+    mapped_nils.update(zip(corr_nils["kbid"].tolist(), corr_nils["kbid_ref"].tolist()))
+
+    return DictWithMissing(mapped_nils)
@@ -0,0 +1,137 @@
+import functools
+import numbers
+import os
+import sys
+
+import jsonschema
+import simplejson as json
+
+SCHEMA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "schemas")
+
+SCHEMA_FILES = {
+    "V1": "LoReHLT19-schema_V1.json",
+    "V2": "LoReHLT19-schema_V2.json",
+    "LoReHLT18": "LoReHLT18-schema_V2.json",
+}
+
+# keywords compilecheck knows how to translate; any other keyword disables the fast path
+FAST_KEYWORDS = {
+    "$schema",
+    "$version",
+    "definitions",
+    "type",
+    "enum",
+    "minimum",
+    "maximum",
+    "properties",
+    "required",
+    "items",
+    "anyOf",
+}
+
+
+@functools.lru_cache(maxsize=None)
+def getschema(version="V1"):
+    schemafile = os.path.join(SCHEMA_DIR, SCHEMA_FILES[version])
+    try:
+        with open(schemafile, "r") as f:
+            schema_data = f.read()
+            schema = json.loads(schema_data)
+    except:
+        sys.exit("CAN NOT OPEN JSON SCHEMA FILE: " + schemafile)
+    return schema
+
+
+def itemschema(schema):
+    """The schema of a single frame of a submission schema."""
+    frameschema = {k: v for k, v in schema.items() if k not in ("type", "items")}
+    frameschema.update(schema["items"])
+    return frameschema
+
+
+def istype(x, jsontype):
+    if jsontype == "number":
+        return isinstance(x, numbers.Number) and not isinstance(x, bool)
+    if jsontype == "integer":
+        return isinstance(x, int) and not isinstance(x, bool)
+    return isinstance(x, {"string": str, "boolean": bool, "object": dict, "array": list}[jsontype])
+
+
+def compilecheck(node, root):
+    """Plain Python predicate for a schema node. It only accepts instances jsonschema
+    accepts, and returns None when the node uses keywords outside FAST_KEYWORDS."""
+    if "$ref" in node:
+        if set(node) != {"$ref"} or not node["$ref"].startswith("#/definitions/"):
+            return None
+        return compilecheck(root["definitions"][node["$ref"][len("#/definitions/"):]], root)
+    if set(node) - FAST_KEYWORDS:
+        return None
+
+    checks = []
+    if "type" in node:
+        if node["type"] not in ("string", "number", "integer", "boolean", "object", "array"):
+            return None
+        checks.append(functools.partial(lambda jsontype, x: istype(x, jsontype), node["type"]))
+    if "enum" in node:
+        if not all(istype(v, "string") or istype(v, "number") for v in node["enum"]):
+            return None
+        values = frozenset(node["enum"])
+        checks.append(
+            lambda x: (istype(x, "string") or istype(x, "number")) and x in values
+        )
+    if "minimum" in node:
+        minimum = node["minimum"]
+        checks.append(lambda x: not istype(x, "number") or x >= minimum)
+    if "maximum" in node:
+        maximum = node["maximum"]
+        checks.append(lambda x: not istype(x, "number") or x <= maximum)
+    if "required" in node:
+        required = list(node["required"])
+        checks.append(lambda x: not isinstance(x, dict) or all(k in x for k in required))
+    if "properties" in node:
+        properties = []
+        for k, v in node["properties"].items():
+            check = compilecheck(v, root)
+            if check is None:
+                return None
+            properties.append((k, check))
+        checks.append(
+            lambda x: not isinstance(x, dict)
+            or all(check(x[k]) for k, check in properties if k in x)
+        )
+    if "items" in node:
+        if not isinstance(node["items"], dict):
+            return None
+        check = compilecheck(node["items"], root)
+        if check is None:
+            return None
+        checks.append(lambda x: not isinstance(x, list) or all(check(item) for item in x))
+    if "anyOf" in node:
+        branches = [compilecheck(branch, root) for branch in node["anyOf"]]
+        if any(check is None for check in branches):
+            return None
+        checks.append(lambda x: any(check(x) for check in branches))
+    return lambda x: all(check(x) for check in checks)
+
+
+@functools.lru_cache(maxsize=None)
+def getvalidator(version="V1", items=False):
+    """jsonschema validator and fast structural check (None if the schema can not be
+    compiled to one) for a submission, or with items for a single frame, compiled once
+    per schema version."""
+    schema = getschema(version)
+    if items:
+        schema = itemschema(schema)
+    validator = jsonschema.validators.validator_for(schema)(schema)
+    return validator, compilecheck(schema, schema)
+
+
+def validatesubmission(d, version="V1", items=False, fast=True):
+    """Raises jsonschema.ValidationError if d is not a valid submission (or frame).
+    jsonschema only runs when the fast check fails, to produce the error message."""
+    validator, fastcheck = getvalidator(version, items)
+    if fast and fastcheck is not None and fastcheck(d):
+        return
+    error = jsonschema.exceptions.best_match(validator.iter_errors(d))
+    if error is not None:
+        raise error
@@ -193,3 +193,11 @@ class TestCorrectkbids(TestCase):
         assert_frame_equal(
             correctkbids(self.systemTable, self.reference), self.correctsystemTable
         )
+
+    def test_kbid_alias_index(self):
+        alias = kbid_alias_index(self.reference)
+        self.assertEqual(
+            sorted(alias["Place_KB_ID"].tolist()), ["11186696", "384272"]
+        )
+        self.assertTrue((alias["canonical_kb_id"] == "11186696|384272").all())
+        self.assertTrue((alias["DocumentID"] == "DOC2").all())
@@ -0,0 +1,104 @@
+from unittest import TestCase
+import sys
+import os
+
+lib_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../")
+sys.path.append(lib_path)
+
+from lib.lorehlt19helper import *
+
+
+class TestGenpr(TestCase):
+    def setUp(self):
+        self.referenceTable = pd.DataFrame(
+            {
+                "doc_id": ["File_1", "File_1", "File_2"],
+                "type": ["food", "food", "water"],
+                "kb_id": ["1", "1", "2"],
+                "status": ["current", "past", "current"],
+                "urgent": [True, True, False],
+                "unresolved": [True, False, True],
+                "current": [True, False, True],
+            }
+        )
+        self.systemTable = pd.DataFrame(
+            {
+                "DocumentID": ["File_1", "File_1", "File_3"],
+                "Type": ["food", "food", "food"],
+                "Place_KB_ID": ["1", "1", "1"],
+                "Status": ["current", "current", "current"],
+                "Confidence": [0.4, 0.9, 0.7],
+                "urgent": [True, True, False],
+                "unresolved": [True, True, True],
+                "current": [True, True, True],
+            }
+        )
+
+    def test_genpr_dtp(self):
+        merged = genpr_dtp(self.systemTable, self.referenceTable, 0.5)
+        self.assertEqual(merged.shape[0], 3)
+        self.assertListEqual(merged.Confidence.tolist(), [0.9, 0.7, 0.0])
+        self.assertListEqual(merged.label.tolist(), [1, 0, 1])
+        self.assertListEqual(merged.pred.tolist(), [1, 1, 0])
+        self.assertListEqual(merged.fn.tolist(), [0, 0, 1])
+
+    def test_genpr_shared_alignment(self):
+        alignment = frame_alignment(self.systemTable, self.referenceTable)
+        merged = genpr_dtpsur(self.systemTable, self.referenceTable, 0.5, alignment)
+        self.assertEqual(merged.label.sum(), 3)
+        self.assertEqual(merged.tp.sum(), 1)
+        self.assertEqual(merged.fp.sum(), 1)
+
+    def test_precision_recall_scores(self):
+        # the scores of sklearn's precision_recall_curve, average_precision_score,
+        # precision_score, recall_score and f1_score
+        scores = precision_recall_scores([1, 0, 1, 0, 1], [0.9, 0.8, 0.8, 0.3, 0.0], 0.5)
+        self.assertListEqual(scores["precision"].tolist(), [0.6, 0.5, 0.6666666666666666, 1.0, 1.0])
+        self.assertListEqual(scores["recall"].tolist(), [1.0, 0.6666666666666666, 0.6666666666666666, 0.3333333333333333, 0.0])
+        self.assertListEqual(scores["thresholds"].tolist(), [0.0, 0.3, 0.8, 0.9])
+        self.assertEqual(scores["AP"], 0.7555555555555555)
+        self.assertEqual(scores["Precision"], 0.6666666666666666)
+        self.assertEqual(scores["Recall"], 0.6666666666666666)
+        self.assertEqual(scores["F1"], 0.6666666666666666)
+        self.assertEqual(precision_recall_scores([], [], 0.5)["F1"], 0.0)
+
+    def test_f1_from_counts(self):
+        # tp 1, fp 1, fn 4: 2 tp / (2 tp + fp + fn) is 0.2857142857142857, while
+        # 2 P R / (P + R) rounds to 0.28571428571428575
+        labels, confidences = [1, 0, 1, 1, 1, 1], [0.9, 0.8, 0.4, 0.3, 0.2, 0.1]
+        self.assertEqual(precision_recall_scores(labels, confidences, 0.5)["F1"], 0.2857142857142857)
+        self.assertEqual(precision_recall_scores(labels, confidences, 0.5)["OptimalF1"], 0.9090909090909091)
+        merged = pd.DataFrame({"label": labels, "Confidence": confidences, "system_id": "a"})
+        scores = precision_recall_systems(merged, 0.5, ["a"])
+        self.assertEqual(scores["F1"][0], 0.2857142857142857)
+
+    def test_genpr_stacked(self):
+        tables = [self.systemTable, self.systemTable.iloc[[0, 2]], self.systemTable.iloc[:0]]
+        stacked = stacksubmissions(tables, ["a", "b", "c"])
+        alignment = frame_alignment(stacked, self.referenceTable)
+        merged = genpr(alignment, "TypePlace", [0.5, 0.3, 0.5], ["a", "b", "c"])
+        scores = precision_recall_systems(merged, [0.5, 0.3, 0.5], ["a", "b", "c"])
+        for i, (table, threshold) in enumerate(zip(tables, [0.5, 0.3, 0.5])):
+            expected = genpr_dtp(table, self.referenceTable, threshold)
+            mine = merged[merged.system_id == ["a", "b", "c"][i]]
+            self.assertListEqual(sorted(mine.Confidence.tolist()), sorted(expected.Confidence.tolist()))
+            self.assertListEqual(sorted(mine.pred.tolist()), sorted(expected.pred.tolist()))
+            expected = precision_recall_scores(expected.label.values, expected.Confidence.values, threshold)
+            for score in ["Precision", "Recall", "F1"]:
+                self.assertEqual(scores[score][i], expected[score])
+
+    def test_optimal_threshold(self):
+        labels, confidences = [1, 0, 1, 0, 1, 1], [0.9, 0.8, 0.8, 0.6, 0.3, 0.0]
+        scores = precision_recall_scores(labels, confidences, 0.5)
+        self.assertEqual(scores["OptimalThreshold"], 0.0)
+        self.assertAlmostEqual(scores["OptimalF1"], 2.0 / 3)
+        for threshold in [0.0, 0.3, 0.6, 0.8, 0.9]:
+            self.assertLessEqual(precision_recall_scores(labels, confidences, threshold)["F1"], scores["OptimalF1"])
+        atoptimal = precision_recall_scores(labels, confidences, scores["OptimalThreshold"])
+        for score in ["Precision", "Recall", "F1"]:
+            self.assertEqual(atoptimal[score], scores["Optimal" + score])
+        scores = precision_recall_scores([1, 1, 0], [0.9, 0.7, 0.4], 0.8)
+        self.assertEqual((scores["OptimalThreshold"], scores["OptimalF1"]), (0.4, 1.0))
+        scores = precision_recall_scores([1, 1], [0.9, 0.7], 0.8)
+        self.assertEqual((scores["OptimalThreshold"], scores["OptimalF1"]), (0.0, 1.0))
+        self.assertIsNone(precision_recall_scores([], [], 0.5)["OptimalThreshold"])
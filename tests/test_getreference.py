@@ -0,0 +1,67 @@
+from unittest import TestCase
+import tempfile
+import sys
+import os
+
+lib_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../")
+sys.path.append(lib_path)
+
+from lib.lorehlt19helper import *
+
+
+class TestReferenceCache(TestCase):
+    def setUp(self):
+        self.base_dir = os.path.dirname(os.path.realpath(__file__))
+        self.reference = os.path.join(
+            self.base_dir, "SEC_test1", "setE", "data", "annotation", "eng", "situation_frame"
+        )
+        self.cachedir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.cachedir.cleanup()
+
+    def test_cached_reference(self):
+        expected = getReference(self.reference, numeric_gravity, None)
+        for i in range(2):
+            cached = getReference(self.reference, numeric_gravity, None, cachedir=self.cachedir.name)
+            pd.testing.assert_frame_equal(expected, cached)
+            self.assertEqual(len(os.listdir(self.cachedir.name)), 1)
+        getReferenceBase(self.reference, None, altref=True, cachedir=self.cachedir.name)
+        self.assertEqual(len(os.listdir(self.cachedir.name)), 2)
+
+
+class TestAnnotatorChoice(TestCase):
+    def setUp(self):
+        self.base_dir = os.path.dirname(os.path.realpath(__file__))
+        self.tab = os.path.join(
+            self.base_dir, "Test_MAPMAR_UrgentUnresolved", "needs", "reference.tab"
+        )
+
+    def test_perfile_choice_ignores_random_state(self):
+        df = readReferenceTab(self.tab)
+        df = pd.concat([df, df.assign(user_id="other")], ignore_index=True)
+        chosen = []
+        for seed in range(5):
+            random.seed(seed)
+            rng = random.Random(os.path.basename(self.tab))
+            chosen.append(chooseAnnotator(df, 0, rng).user_id.unique().tolist())
+        self.assertEqual(len(chosen[0]), 1)
+        self.assertTrue(all(c == chosen[0] for c in chosen))
+        altref = chooseAnnotator(df, 1, random.Random(os.path.basename(self.tab)))
+        self.assertNotEqual(altref.user_id.unique().tolist(), chosen[0])
+
+
+class TestSentiments(TestCase):
+    def test_groupsentiments(self):
+        sentiments = pd.DataFrame(
+            {
+                "doc_id": ["d1", "d1", "d1", "d2", "d2"],
+                "target": ["f1", "f1", "f2", "f1", "f1"],
+                "emotion_value": ["fear", "anger,joyhappiness", np.nan, np.nan, np.nan],
+            }
+        )
+        grouped = groupsentiments(sentiments)
+        self.assertListEqual(
+            grouped.values.tolist(),
+            [["d1", "f1", "fear,anger,joyhappiness"], ["d1", "f2", ""], ["d2", "f1", ""]],
+        )
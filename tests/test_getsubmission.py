@@ -1,6 +1,7 @@
 from unittest import TestCase
 import sys
 import os
+import io
 
 lib_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../")
 sys.path.append(lib_path)
@@ -34,3 +35,36 @@ class TestGoodSubmission(TestCase):
         with self.assertRaises(SystemExit) as cm:
             self.submission = getsubmission(self.testfile, boolean_gravity, filelist="")
         self.assertNotEqual(cm.exception.code, 1)
+
+
+class TestSubmissionBase(TestCase):
+    def setUp(self):
+        self.base_dir = os.path.dirname(os.path.realpath(__file__))
+        self.testfile = os.path.join(self.base_dir, "SEC_test2", "perfect_submission.json")
+
+    def test_gravity_from_base(self):
+        base = getsubmissionBase(self.testfile, filelist="")
+        for gravity in (boolean_gravity, numeric_gravity):
+            submission = getsubmission(self.testfile, gravity, filelist="")
+            pd.testing.assert_frame_equal(withgravity(base, gravity), submission)
+        self.assertNotIn("gravity", base.columns)
+
+    def test_streamed_base(self):
+        base = getsubmissionBase(self.testfile, filelist="")
+        for chunksize in (1, 3, SUBMISSION_CHUNKSIZE):
+            streamed = getsubmissionBase(self.testfile, filelist="", chunksize=chunksize)
+            pd.testing.assert_frame_equal(base, streamed)
+
+    def test_sec_blocks(self):
+        base, blocks = getsubmissionBase(self.testfile, filelist="", sec=True)
+        pd.testing.assert_frame_equal(base, getsubmissionBase(self.testfile, filelist=""))
+        self.assertEqual(len(blocks), sum(len(sec) for sec in base["SEC"]))
+        for frame, sec in base["SEC"].items():
+            frameblocks = blocks[blocks["frame"] == frame]
+            self.assertListEqual(frameblocks["Source"].tolist(), [block["Source"] for block in sec])
+            self.assertEqual(base.loc[frame, "fear"], any(block.get("Emotion_Fear") for block in sec))
+            self.assertEqual(base.loc[frame, "anger"], any(block.get("Emotion_Anger") for block in sec))
+
+    def test_iterjsonarray(self):
+        f = io.StringIO(' [ {"a": [1, 2]} ,\n{"b": 12345}, 7 ]\n')
+        self.assertListEqual(list(iterjsonarray(f, bufsize=4)), [{"a": [1, 2]}, {"b": 12345}, 7])
@@ -0,0 +1,41 @@
+from unittest import TestCase
+import numpy.testing as npt
+import sys
+import os
+
+lib_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../")
+sys.path.append(lib_path)
+
+from lib.lorehlt19helper import *
+
+
+class TestGravityColumns(TestCase):
+    def setUp(self):
+        self.reference = pd.DataFrame(
+            {
+                "frame_type": ["need", "need", "issue", "issue", "issue", "need"],
+                "current": [True, True, True, True, False, True],
+                "unresolved": [True, True, False, False, False, False],
+                "urgent": [True, True, True, True, True, True],
+                "emotion_value": [("fear,anger",), np.nan, ("anger", np.nan), ("fear", "anger"), ("fear",), ()],
+            }
+        )
+        self.submission = self.reference.drop("emotion_value", axis=1)
+        self.submission["SEC"] = [
+            [{"Emotion_Fear": True, "Emotion_Anger": False}, {"Emotion_Fear": False, "Emotion_Anger": True}],
+            [],
+            [{"Emotion_Fear": False, "Emotion_Anger": True}],
+            [{"Emotion_Fear": True, "Emotion_Anger": True}],
+            [{"Emotion_Fear": True, "Emotion_Anger": False}],
+            [{"Emotion_Fear": False, "Emotion_Anger": False}],
+        ]
+
+    def test_gravity_columns_match_rows(self):
+        for table in (self.reference, self.submission):
+            npt.assert_array_equal(
+                numeric_gravity_column(table), table.apply(numeric_gravity, axis=1).values
+            )
+            npt.assert_array_equal(
+                boolean_gravity_column(table), table.apply(boolean_gravity, axis=1).values
+            )
+        npt.assert_almost_equal(numeric_gravity_column(self.reference), [1.4, 1.0, 1.0, 1.2, 0.0, 0.0])
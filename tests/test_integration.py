@@ -49,3 +49,62 @@ def test_this_test(expected_file, ref, sub, EDL_ref, EDL_sub, tmp_path):
     with patch.object(sys, "argv", test_args):
         main()
         assert filecmp.cmp(expected_file, expected_file_location.as_posix())
+
+
+def test_manifest(tmp_path):
+    expected_file, ref, sub, EDL_sub, EDL_ref = test_input_data[0]
+    manifest = tmp_path / "manifest.tsv"
+    manifest.write_text(
+        "# system\tsubmission\tEDL submission\tprefix\n"
+        "SYSTEM_A\t{0}\t{1}\tPREFIX\n"
+        "SYSTEM_B\t{0}\t{1}\n".format(sub, EDL_sub)
+    )
+    output_dir = tmp_path / "tmp_output"
+    test_args = [
+        "test",
+        "-g",
+        ref,
+        "--manifest",
+        manifest.as_posix(),
+        "-o",
+        output_dir.as_posix(),
+        "-r",
+        EDL_ref,
+        "--workers",
+        "2",
+    ]
+
+    with patch.object(sys, "argv", test_args):
+        main()
+    assert filecmp.cmp(expected_file, (output_dir / "SYSTEM_A" / "PREFIX_diagnostic_SEC_scores.txt").as_posix())
+    assert filecmp.cmp(expected_file, (output_dir / "SYSTEM_B" / "_diagnostic_SEC_scores.txt").as_posix())
+
+
+def test_manifest_duplicate_system(tmp_path):
+    expected_file, ref, sub, EDL_sub, EDL_ref = test_input_data[0]
+    manifest = tmp_path / "manifest.tsv"
+    manifest.write_text("SYSTEM_A\t{0}\nSYSTEM_A\t{0}\n".format(sub))
+    test_args = ["test", "-g", ref, "--manifest", manifest.as_posix(), "-o", tmp_path.as_posix()]
+
+    with patch.object(sys, "argv", test_args):
+        with pytest.raises(SystemExit) as e:
+            main()
+    assert "DUPLICATE SYSTEM NAME" in str(e.value.code)
+
+
+def test_manifest_stacked(tmp_path):
+    expected_file, ref, sub, EDL_sub, EDL_ref = test_input_data[0]
+    manifest = tmp_path / "manifest.tsv"
+    manifest.write_text("SYSTEM_A\t{0}\t{1}\nSYSTEM_B\t{0}\t{1}\n".format(sub, EDL_sub))
+    for mode in ["batch", "stacked"]:
+        test_args = ["test", "-g", ref, "--manifest", manifest.as_posix(), "-o", (tmp_path / mode).as_posix()]
+        test_args += ["-r", EDL_ref, "--workers", "1", "--reference-workers", "1", "--computepr"] + (["--stacked"] if mode == "stacked" else [])
+        with patch.object(sys, "argv", test_args):
+            main()
+    for name in ["SYSTEM_A", "SYSTEM_B"]:
+        batch, stacked = tmp_path / "batch" / name, tmp_path / "stacked" / name
+        outputs = sorted(f.name for f in batch.iterdir() if f.suffix == ".txt")
+        assert filecmp.cmpfiles(batch.as_posix(), stacked.as_posix(), outputs, shallow=False)[0] == outputs
+    scores = (tmp_path / "stacked" / "cross_system_scores.txt").read_text().splitlines()
+    assert scores[0] == "system_id\tmetric\tvalue"
+    assert "SYSTEM_B\tF1_TypePlace\t" in "\n".join(scores)
@@ -552,3 +552,88 @@ class TestMapmar(TestCase):
         npt.assert_almost_equal(mymar1, 1.0, decimal=9)
         npt.assert_almost_equal(mymap2, 0.78333333333333333, decimal=9)
         npt.assert_almost_equal(mymar2, 0.83333333333333337, decimal=9)
+
+    def test_segmented_average_precision(self):
+        groups = [0, 0, 0, 0, 2, 2, 2, 3]
+        scores = [0.9, 0.4, 0.4, 0.1, 0.8, 0.7, 0.3, 0.5]
+        labels = [1, 0, 1, 1, 0, 1, 0, 0]
+        ap = segmented_average_precision(groups, scores, labels, 4)
+        # sklearn's average_precision_score of the groups 0 and 2
+        npt.assert_almost_equal(ap, [0.8055555555555556, 0.0, 0.5, 0.0], decimal=12)
+
+    def test_mapmar_shared_alignment(self):
+        alignment = frame_alignment(self.systemTable2, self.referenceTable)
+        for genTrue in GENTRUE_EQCLASS:
+            npt.assert_almost_equal(
+                mapmar(self.referenceTable, self.systemTable2, genTrue, alignment),
+                mapmar(self.referenceTable, self.systemTable2, genTrue),
+                decimal=12,
+            )
+
+    def test_mapmar_systems(self):
+        tables = [self.systemTable1, self.systemTable2, self.systemTable3, self.systemTable4]
+        stacked = stacksubmissions(tables, ["s1", "s2", "s3", "s4"])
+        for genTrue, eqclass in MAPMAR_EQCLASSES:
+            mymap, mymar = mapmar_systems(self.referenceTable, stacked, genTrue)
+            expected = np.array([mapmar(self.referenceTable, table, genTrue) for table in tables])
+            npt.assert_array_equal(mymap, expected[:, 0])
+            npt.assert_array_equal(mymar, expected[:, 1])
+        scores = genMAPMAR_systems(self.referenceTable, stacked)
+        self.assertEqual(scores.shape[0], 4 * 12)
+        self.assertListEqual(scores.system_id.tolist()[:4], ["s1", "s2", "s3", "s4"])
+
+    def assertSweepMatches(self, referenceTable, systemTable, thresholds):
+        # cutoffs past the longest curve, so every k and N of every threshold is a column
+        sweep = threshold_sweep(referenceTable, systemTable, thresholds, cutoffs=range(1, len(referenceTable) + 1))
+        self.assertListEqual(sweep.index.tolist(), thresholds)
+        referenceNDCG = getreferenceNDCG(referenceTable)
+        for threshold in thresholds:
+            mysystemTable = systemTable[systemTable.Confidence > threshold]
+            for genTrue, eqclass in MAPMAR_EQCLASSES:
+                mymap, mymar = mapmar(referenceTable, mysystemTable, genTrue)
+                npt.assert_array_equal(sweep.loc[threshold, [eqclass + "_MAP", eqclass + "_MAR"]], [mymap, mymar])
+            for breakties in NDCG_BREAKTIES:
+                myndcg, k = genNDCG(referenceNDCG, mysystemTable, breakties=breakties)
+                columns = ["%s_nDCG@%s" % (breakties, x) for x in k]
+                self.assertListEqual(sweep.loc[threshold, columns].tolist(), myndcg)
+            myprecisionN = precisionN(referenceNDCG, mysystemTable)
+            columns = ["P@%s" % n for n, _ in myprecisionN]
+            self.assertListEqual(sweep.loc[threshold, columns].tolist(), [p for _, p in myprecisionN])
+
+    def test_threshold_sweep(self):
+        self.assertSweepMatches(self.referenceTable, self.systemTable3, [0.0, 0.75, 0.86])
+
+        # long enough curves for any difference in how the sums are taken to show
+        rng = np.random.RandomState(0)
+        n, m = 150, 80
+        referenceTable = pd.DataFrame(
+            {
+                "doc_id": ["File_%d" % i for i in rng.randint(0, 20, n)],
+                "frame_id": "Frame-1",
+                "kb_id": [str(i) for i in rng.randint(0, 12, n)],
+                "user_id": rng.randint(1, 4, n),
+                "type": rng.choice(["food", "water", "med"], n),
+                "urgent": rng.rand(n) < 0.8,
+                "unresolved": rng.rand(n) < 0.8,
+                "current": rng.rand(n) < 0.9,
+                "gravity": rng.rand(n) < 0.8,
+                "frame_count": 1,
+            }
+        )
+        systemTable = pd.DataFrame(
+            {
+                "Confidence": rng.rand(m).round(2),
+                "DocumentID": ["File_%d" % i for i in rng.randint(0, 20, m)],
+                "Justification_ID": "segment-0",
+                "Place_KB_ID": [str(i) for i in rng.randint(0, 12, m)],
+                "Resolution": "insufficient",
+                "Status": "current",
+                "Type": rng.choice(["food", "water", "med"], m),
+                "urgent": rng.rand(m) < 0.5,
+                "unresolved": rng.rand(m) < 0.5,
+                "current": rng.rand(m) < 0.7,
+                "gravity": rng.rand(m) < 0.6,
+                "frame_count": 1,
+            }
+        )
+        self.assertSweepMatches(referenceTable, systemTable, [0.0, 0.3, 0.6, 0.9])
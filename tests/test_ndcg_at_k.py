@@ -426,3 +426,45 @@ class TestNdcg_at_k(TestCase):
         npt.assert_almost_equal(
             np.array(testndcg), np.array(self.myndcgvindictive2), decimal=9
         )
+
+    def test_ndcg_curve_matches_ndcg_at_k(self):
+        rng = np.random.RandomState(0)
+        gains = rng.choice([0, 1, 5, 10], 300)
+        for merged in [
+            pd.DataFrame({"gain": [5, 10, 0, 1, 10, 5, 0], "sysgain": [5, 0, 0, 1, 10, 0, 0]}),
+            pd.DataFrame({"gain": gains, "sysgain": gains * rng.randint(0, 2, 300)}),
+        ]:
+            for method in (0, 1):
+                k = range(1, len(merged) + 1)
+                npt.assert_almost_equal(
+                    ndcg_curve(merged, method), [ndcg_at_k(merged, i, method) for i in k], decimal=12
+                )
+
+    def test_genNDCG_variants(self):
+        curves, k = genNDCG_variants(
+            self.myref, self.mysys2, breakties=NDCG_BREAKTIES, methods=(0, 1)
+        )
+        for breakties in NDCG_BREAKTIES:
+            for method in (0, 1):
+                testndcg, testk = genNDCG(
+                    self.myref, self.mysys2, breakties=breakties, method=method
+                )
+                self.assertEqual(list(k), list(testk))
+                npt.assert_almost_equal(
+                    np.array(curves[(breakties, method)]), np.array(testndcg), decimal=12
+                )
+        npt.assert_almost_equal(
+            np.array(curves[("forgiving", 0)]), np.array(self.myndcgforgiving2), decimal=9
+        )
+
+    def test_genNDCG_systems(self):
+        stacked = stacksubmissions([self.mysys1, self.mysys2, self.mysys1.iloc[:0]], ["a", "b", "c"])
+        ndcg = genNDCG_systems(self.myref, stacked, ["a", "b", "c"], methods=(0, 1))
+        for name, table in [("a", self.mysys1), ("b", self.mysys2), ("c", self.mysys1.iloc[:0])]:
+            curves, k = genNDCG_variants(self.myref, table, methods=(0, 1))
+            for (breakties, method), curve in curves.items():
+                mine = ndcg[
+                    (ndcg.system_id == name) & (ndcg.breakties == breakties) & (ndcg.method == method)
+                ]
+                self.assertListEqual(mine.k.tolist(), list(k))
+                self.assertListEqual(mine.nDCG.tolist(), curve)
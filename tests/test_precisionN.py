@@ -221,3 +221,17 @@ class TestPrecisionN(TestCase):
         myprecisionN = precisionN(self.myref, self.mysys1)
         correctPrecisionN = [(1, 1.0), (2, 0.5)]
         TestCase.assertListEqual(self, myprecisionN, correctPrecisionN)
+
+    def test_precisionN_cutoffs(self):
+        myprecisionN = precisionN(self.myref, self.mysys1, cutoffs=[2, 5])
+        TestCase.assertListEqual(self, myprecisionN, [(2, 0.5)])
+        self.assertIn("gain", self.myref.columns)
+
+    def test_precisionN_systems(self):
+        stacked = stacksubmissions([self.mysys1, self.mysys1.iloc[[7, 9]]], ["a", "b"])
+        myprecisionN = precisionN_systems(self.myref, stacked)
+        self.assertListEqual(myprecisionN.system_id.tolist(), ["a", "a", "b", "b"])
+        self.assertListEqual(myprecisionN.precision.tolist(), [1.0, 0.5, 1.0, 0.5])
+        myprecisionN = precisionN_systems(self.myref, stacked, ["b", "c"], cutoffs=[2])
+        self.assertListEqual(list(zip(myprecisionN.system_id, myprecisionN.N)), [("b", 2), ("c", 2)])
+        self.assertListEqual(myprecisionN.precision.tolist(), [0.5, 0.0])
@@ -1,6 +1,22 @@
+import os
+
+import numpy as np
+import pandas as pd
 import pytest
 
-from lib.sec_helper import DictWithMissing
+from lib.sec_helper import (
+    DictWithMissing,
+    SEC_scores,
+    SEC_scoring,
+    class_SEC_submission,
+    flatten_SEC,
+    edl_index,
+    matching_sentiments,
+    nil_mapper,
+    penalty,
+)
+
+SEC_TEST1 = os.path.join(os.path.dirname(os.path.abspath(__file__)), "SEC_test1")
 
 
 @pytest.mark.parametrize("d", [{}, {"a": 2, "b": "hello"}])
@@ -12,3 +28,195 @@ def test_DictWithMissing(d):
     assert d2[unknown_key] == unknown_key
 
 
+def test_matching_sentiments():
+    sub = pd.DataFrame(
+        {
+            "doc_id": ["d1", "d1", "d2", "d1"],
+            "kb_id": ["k1", "k1", "k1", "k1"],
+            "polarity": ["negative", "positive", "negative", "negative"],
+            "Source": ["s1", "s1", "s1", np.nan],
+        }
+    )
+    ref = pd.DataFrame(
+        {
+            "doc_id": ["d1", "d2", "d1", "d1"],
+            "kb_id": ["k1", "k1", "k1", "k1"],
+            "polarity": ["negative", "negative", "negative", "negative"],
+            "kb_id_sentiments": ["s1", "s1", "s1", np.nan],
+        }
+    )
+    pairs = matching_sentiments(sub, ref, ["doc_id", "kb_id"])
+    assert pairs.values.tolist() == [[0, 0], [0, 2], [2, 1]]
+
+
+def test_flatten_SEC():
+    sec = pd.Series(
+        [
+            [{"Sentiment": -1, "Source": "s1", "Emotion_Fear": True}],
+            [],
+            [{"Sentiment": 2.5, "Source": "s2", "Emotion_Anger": False, "Emotion_Joy": True}, {"Sentiment": 0.5}],
+        ],
+        index=[4, 7, 9],
+    )
+    flat = flatten_SEC(sec)
+    assert flat["frame"].tolist() == [4, 9, 9]
+    assert flat["Sentiment"].tolist() == [-1.0, 2.5, 0.5]
+    assert flat["Source"].tolist() == ["s1", "s2", None]
+    np.testing.assert_array_equal(flat["Emotion_Anger"].values, [np.nan, 0.0, np.nan])
+    np.testing.assert_array_equal(flat["Emotion_Fear"].values, [1.0, np.nan, np.nan])
+    assert flat["positive"].tolist() == [False, True, True]
+
+
+def test_class_SEC_submission():
+    flat = pd.DataFrame(
+        {
+            "doc_id": ["d2", "d1", "d1", "d2"],
+            "status": ["current", np.nan, "past", "current"],
+            "Sentiment": [1, 2, 3, 4],
+        }
+    )
+    assert class_SEC_submission(flat, ["doc_id"])["Sentiment"].tolist() == [2, 3, 1, 4]
+    assert class_SEC_submission(flat, ["doc_id", "status"])["Sentiment"].tolist() == [3, 1, 4]
+
+
+def test_SEC_scores():
+    reference = pd.DataFrame(
+        {
+            "doc_id": ["d1", "d1"],
+            "frame_id": ["f1", "f2"],
+            "kb_id": ["k1", "k2"],
+            "type": ["food", "food"],
+            "status": ["current", "past"],
+        }
+    )
+    sec_ref = pd.DataFrame(
+        {
+            "doc_id": ["d1", "d1"],
+            "target": ["f1", "f2"],
+            "kb_id": ["s1", "s1"],
+            "polarity": ["negative", "positive"],
+            "sentiment_value": [-2, 1],
+            "emotion_value": ["anger,fear", np.nan],
+        }
+    )
+    block = {"Source": "s1", "Emotion_Anger": True, "Emotion_Fear": True, "Emotion_Joy": False}
+    submission = pd.DataFrame(
+        {
+            "DocumentID": ["d1", "d1"],
+            "Place_KB_ID": ["k1", "NIL1"],
+            "Type": ["food", "food"],
+            "Status": [np.nan, "past"],
+            "SEC": [[dict(block, Sentiment=-1)], [dict(block, Sentiment=2), dict(block, Sentiment=-2)]],
+        }
+    )
+    mapping = DictWithMissing({"NIL1": "k2"})
+    pairs = [
+        (["doc_id", "kb_id", "type"], ["DocumentID", "Place_KB_ID", "Type"], "Type+Place"),
+        (
+            ["doc_id", "kb_id", "type", "status"],
+            ["DocumentID", "Place_KB_ID", "Type", "Status"],
+            "Type+Place+Status",
+        ),
+    ]
+    scores = SEC_scores(reference, sec_ref, submission, mapping, pairs)
+    submission.index = [3, 5]
+    blocks = flatten_SEC(pd.concat([submission["SEC"], pd.Series([[block]], index=[4])]))
+    assert SEC_scores(reference, sec_ref, submission, mapping, pairs, blocks) == scores
+    # the scores of SEC_scoring before the classes were scored together
+    assert [list(s) for s in scores] == [
+        [
+            0.6666666666666666,
+            1.0,
+            0.8,
+            0.6466666666666666,
+            0.97,
+            0.7759999999999999,
+            0.4444444444444444,
+            0.6666666666666666,
+            0.5333333333333333,
+        ],
+        [
+            0.5,
+            0.5,
+            0.5,
+            0.485,
+            0.485,
+            0.485,
+            0.16666666666666666,
+            0.16666666666666666,
+            0.16666666666666666,
+        ],
+    ]
+    assert SEC_scoring(reference, sec_ref, submission, mapping, *pairs[1][:2]) == scores[1]
+
+
+def test_penalty():
+    assert penalty([1, 1, 1, 1, np.nan], [1.5, 0, -0.5, -2, 1]).tolist() == [
+        1.0,
+        0.97,
+        0.97,
+        0.97 ** 2,
+        0.97 ** 2,
+    ]
+
+
+def test_nil_mapper():
+    subm_edl = os.path.join(SEC_TEST1, "diff_nil_edl.tab")
+    ref_edl = os.path.join(SEC_TEST1, "setE", "data", "annotation", "eng", "sec_test_eng_edl.tab")
+    mapping = nil_mapper(subm_edl, ref_edl)
+    assert len(mapping) == 27
+    assert mapping["NIL9000043"] == "NIL2000043"
+    assert mapping["1000004"] == "1000004"
+    restricted = nil_mapper(subm_edl, ref_edl, docs=["ENG_NW_006929_20180924_I00263TMF"])
+    assert len(restricted) == 7
+    assert all(mapping[k] == v for k, v in restricted.items())
+
+
+def test_edl_index_cache(tmpdir):
+    subm_edl = os.path.join(SEC_TEST1, "diff_nil_edl.tab")
+    ref_edl = os.path.join(SEC_TEST1, "setE", "data", "annotation", "eng", "sec_test_eng_edl.tab")
+    expected = nil_mapper(subm_edl, ref_edl)
+    for i in range(2):
+        assert nil_mapper(subm_edl, ref_edl, cachedir=str(tmpdir)) == expected
+        assert len(tmpdir.listdir()) == 1
+    assert isinstance(edl_index(ref_edl, cachedir=str(tmpdir)), np.memmap)
+
+
+def test_nil_mapper_overlap(tmpdir):
+    ref_edl = tmpdir.join("ref.tab")
+    ref_edl.write(
+        "header\n"
+        + "".join(
+            "LDC\tm\tt\t{}\t{}\tPER\tNAM\t1.0\n".format(e, k)
+            for e, k in [
+                ("D1:10-20", "NIL1"),
+                ("D1:12-30", "NIL2"),
+                ("D1:40-45", "NIL3"),
+                ("D2:10-20", "NIL4"),
+            ]
+        )
+    )
+    subm_edl = tmpdir.join("sub.tab")
+    subm_edl.write(
+        "".join(
+            "SYS\tm\tt\t{}\t{}\tPER\tNAM\t1.0\n".format(e, k)
+            for e, k in [
+                ("D1:11-20", "NIL91"),
+                ("D1:25-35", "NIL92"),
+                ("D1:46-50", "NIL93"),
+                ("D3:10-20", "NIL94"),
+            ]
+        )
+    )
+    assert nil_mapper(str(subm_edl), str(ref_edl)) == {
+        "NIL91": "None",
+        "NIL92": "None",
+        "NIL93": "None",
+        "NIL94": "None",
+    }
+    assert nil_mapper(str(subm_edl), str(ref_edl), policy="overlap") == {
+        "NIL91": "NIL1",
+        "NIL92": "NIL2",
+        "NIL93": "None",
+        "NIL94": "None",
+    }
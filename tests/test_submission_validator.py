@@ -0,0 +1,60 @@
+from unittest import TestCase
+import copy
+import sys
+import os
+
+lib_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../")
+sys.path.append(lib_path)
+
+from lib.submission_validator import *
+
+
+class TestSubmissionValidator(TestCase):
+    def setUp(self):
+        self.frame = {
+            "DocumentID": "File_1",
+            "Type": "food",
+            "Confidence": 0.5,
+            "Place_KB_ID": "1",
+            "Justification_ID": "Segment-0",
+            "Status": "current",
+            "SEC": [
+                {
+                    "Sentiment": -2.5,
+                    "Source": "Ent-1",
+                    "Emotion_Fear": True,
+                    "Emotion_Anger": False,
+                    "Emotion_Joy": False,
+                }
+            ],
+            "Resolution": "insufficient",
+            "Urgent": True,
+        }
+
+    def test_validator_is_cached(self):
+        self.assertIs(getvalidator("V2"), getvalidator("V2"))
+        self.assertIsNotNone(getvalidator("V2")[1])
+
+    def test_fast_check_matches_jsonschema(self):
+        invalid = []
+        for key, value in [
+            ("Confidence", 1.5),
+            ("Confidence", True),
+            ("Type", "terrorism"),
+            ("Urgent", 1),
+            ("SEC", [{"Sentiment": 0, "Source": "Ent-1"}]),
+        ]:
+            frame = copy.deepcopy(self.frame)
+            frame[key] = value
+            invalid.append(frame)
+        frame = copy.deepcopy(self.frame)
+        del frame["Resolution"]
+        invalid.append(frame)
+        for version in SCHEMA_FILES:
+            validator, fastcheck = getvalidator(version)
+            self.assertTrue(fastcheck([self.frame]))
+            validatesubmission([self.frame], version)
+            for frame in invalid:
+                self.assertEqual(fastcheck([frame]), validator.is_valid([frame]))
+        with self.assertRaises(jsonschema.ValidationError):
+            validatesubmission(invalid[0], "V1", items=True)
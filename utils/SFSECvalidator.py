@@ -2,13 +2,15 @@
 
 import os, sys, glob
 import simplejson as json
-import jsonschema
 import subprocess
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from lib.submission_validator import getvalidator, validatesubmission
+
 #os.environ['UNCOMPRESS_DIR'] = '/Users/ona1/Desktop/uncompressdir/'
 #os.environ['FSDB'] = '1'
 edlvalidator = "./validate_system_lorehlt2019_edl.pl"
-schemafile = "../schemas/LoReHLT19-schema_V1.json"
+schemaversion = "V1"
 
 allFiles = glob.glob(os.environ['UNCOMPRESS_DIR'] + "/*")
 if len(allFiles) < 2:
@@ -34,12 +36,7 @@ p = subprocess.run(['./validate_system_lorehlt2019_edl.pl ' + tabFiles[0]], shel
 if p.returncode:
     sys.exit('Error validating EDL file:\n'+ p.stdout.decode())
 
-try:
-    with open(schemafile, 'r') as f:
-        schema_data = f.read()
-        schema = json.loads(schema_data)
-except:
-    sys.exit('CAN NOT OPEN JSON SCHEMA FILE: '+ schemafile)
+getvalidator(schemaversion)
 
 try:
     with open(jsonFiles[0]) as f:
@@ -48,7 +45,7 @@ except:
     sys.exit('CAN NOT OPEN JSON SUBMISSION FILE: '+ jsonFiles[0])
 
 try:
-    jsonschema.validate(d, schema)
+    validatesubmission(d, schemaversion)
 except Exception as e:
     print(e)
     sys.exit('ERROR: System submission json failed validation:\n' + str(e) + '\n')